@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+%prog [OPTIONS] MANIFEST     # Run checkfort on all projects in MANIFEST
+
+MANIFEST is a JSON file containing a list of projects, e.g.
+
+  [{"name": "solver", "inputs": ["solver/src"], "standard": "2003",
+    "emulation": "ifort", "outdir": "reports/solver"},
+   {"name": "io", "inputs": ["io/src", "io/extra.f90"]}]
+
+Supported keys: name, inputs, input_file, standard, emulation, free_form,
+extensions, extra_opts, ignore, ignore_categories, ignore_files,
+ignore_culprits, outdir, output_format, incremental, source_context,
+full_source, compact_html, parse_mode, split_on_overflow, time_limit
+(seconds), memory_limit (MiB).
+Relative paths are relative to the current directory.
+"""
+import os
+import json
+import shlex
+from time import time, gmtime, strftime
+from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
+
+from checkfort import __version__ as version
+from checkfort import project_url
+from checkfort.exceptions import *
+from checkfort.files import InputFileReader, FileList, default_extensions
+from checkfort.filters import EventFilter, EVENT_CATEGORIES
+from checkfort.launcher import do_action, supported_standards, parsers
+from checkfort.launcher import default_standard, default_emulation
+from checkfort.launcher import default_parse_mode
+from checkfort.filegen import render, get_stylesheet
+from checkfort.output import DirectorySink
+from checkfort.splitting import PARTITION_CACHE
+from checkfort.summary import category_counts, partial_reasons
+from checkfort.logging import set_silent_mode, set_verbose_mode
+from checkfort.logging import set_debug_mode, set_log_file
+from checkfort.logging import p_info, p_error, p_status
+
+outdir = "cfort_batch"
+default_jobs = 2
+header = "CheckFort batch mode (Version %s)" % version
+
+def as_list(value):
+    if isinstance(value, basestring):
+        return [x.strip() for x in value.split(",") if x.strip()]
+    return list(value or [])
+
+
+def read_manifest(manifest):
+    """Returns list of project entries (dicts) from the manifest file"""
+    try:
+        with open(manifest) as f:
+            projects = json.load(f)
+    except IOError:
+        raise CheckfortException("Manifest not readable: %s" % manifest)
+    except ValueError, e:
+        raise CheckfortException("Invalid manifest (%s): %s" % (manifest, e))
+
+    if isinstance(projects, dict):
+        projects = projects.get("projects", [])
+    names = set()
+    for p in projects:
+        if not isinstance(p, dict) or not p.get("name"):
+            raise CheckfortException("Manifest entries must have a 'name'")
+        if p["name"] in names:
+            raise CheckfortException("Duplicate project name - " + p["name"])
+        names.add(p["name"])
+        if not p.get("inputs") and not p.get("input_file"):
+            raise CheckfortException("No inputs for project " + p["name"])
+    return projects
+
+
+def project_params(project, batch_outdir):
+    """Validate a manifest entry and return params for do_action()"""
+    name = project["name"]
+    params = {
+        "name": name,
+        "outdir": project.get("outdir", os.path.join(batch_outdir, name)),
+        "output_format": project.get("output_format", "dir"),
+        "incremental": bool(project.get("incremental")),
+        "source_context": project.get("source_context"),
+        "full_source": bool(project.get("full_source")),
+        "compact_html": bool(project.get("compact_html")),
+        "pretend": False,
+        "logfile": os.path.join(batch_outdir, "%s.forcheck.log" % name),
+        "partition_cache": os.path.join(batch_outdir,
+                                        "%s%s" % (name, PARTITION_CACHE)),
+        "extra_opts": shlex.split(project.get("extra_opts", "")),
+        "parse_mode": project.get("parse_mode", default_parse_mode),
+        "parse_jobs": None,
+        "split_on_overflow": bool(project.get("split_on_overflow")),
+        "split_jobs": None,
+        "summary_only": False,
+        "profile": False,
+        "save_listfile": None,
+        "from_listfiles": [],
+        "emulation": project.get("emulation", default_emulation),
+        "standard": str(project.get("standard", default_standard)),
+        "free_format": bool(project.get("free_form")),
+        "time_limit": project.get("time_limit"),
+        "memory_limit": (project.get("memory_limit")
+                         and project["memory_limit"] * 1024 * 1024),
+    }
+
+    if params["standard"] not in supported_standards:
+        raise CheckfortException("Unsupported fortran standard (%s)"
+                                 % params["standard"])
+    if params["parse_mode"] not in parsers:
+        raise CheckfortException("Unsupported parse mode (%s)"
+                                 % params["parse_mode"])
+    if params["standard"] == "77":
+        params["free_format"] = False
+
+    try:
+        ignore_list = [int(x) for x in as_list(project.get("ignore"))]
+    except ValueError:
+        raise CheckfortException("Invalid 'ignore' list. Expecting numeric "
+                                 "event codes")
+    params["event_filter"] = EventFilter(
+                    codes=ignore_list,
+                    categories=as_list(project.get("ignore_categories")),
+                    files=as_list(project.get("ignore_files")),
+                    culprits=as_list(project.get("ignore_culprits")))
+
+    targets = as_list(project.get("inputs"))
+    if project.get("input_file"):
+        try:
+            targets.extend(InputFileReader(project["input_file"])
+                           .get_entries())
+        except IOError:
+            raise CheckfortException("Input file not readable: %s"
+                                     % project["input_file"])
+    extensions = as_list(project.get("extensions")) or default_extensions
+    params["files"] = FileList(targets, extensions).files
+    if not params["files"]:
+        raise CheckfortException("No relevant input files found.")
+    return params
+
+
+def run_project(args):
+    """Runs a single project. Returns dict summarising the results"""
+    project, batch_outdir = args
+    name = project["name"]
+    summary = {"name": name, "error": None, "rc": None,
+               "total": 0, "categories": {}, "top_events": [],
+               "index": None, "seconds": 0, "partial": []}
+    start = time()
+    p_status("[%s] started" % name)
+    try:
+        params = project_params(project, batch_outdir)
+        state = do_action(params)
+    except (CheckfortException, SystemExit), e:
+        summary["error"] = str(e) or "failed"
+        p_status("[%s] FAILED: %s" % (name, summary["error"]))
+        return summary
+    finally:
+        summary["seconds"] = time() - start
+
+    categories = category_counts(state)
+    summary["rc"] = state.run_data.get("rc")
+    summary["partial"] = partial_reasons(state)
+    summary["categories"] = categories
+    summary["total"] = sum(categories.values())
+    summary["top_events"] = sorted(state.event_counter.iteritems(),
+                                   key=lambda x: (-x[1], x[0]))[:5]
+    if params["output_format"] == "dir":
+        summary["index"] = os.path.relpath(
+                            os.path.join(params["outdir"], "index.html"),
+                            batch_outdir)
+    p_status("[%s] done in %.1fs (rc=%s, %d events)"
+             % (name, summary["seconds"], summary["rc"], summary["total"]))
+    return summary
+
+
+def write_summary(summaries, batch_outdir):
+    """Writes cross-project summary (index.html) to batch_outdir"""
+    sink = DirectorySink(batch_outdir)
+    ctx = {
+        "to_root": "",
+        "gen_date": strftime("%a, %d %b %Y %H:%M:%S", gmtime()),
+        "project_url": project_url,
+        "projects": summaries,
+        "categories": EVENT_CATEGORIES,
+    }
+    sink.write("style.css", get_stylesheet({"cssclass": "highlight",
+                                            "style": "default"}))
+    sink.write("index.html", render("batch.html", ctx))
+    sink.write("summary.json", json.dumps(summaries, indent=1))
+    sink.close()
+
+
+def main():
+    o, a = parse_options()
+
+    if o.quiet or not o.verbose:
+        set_silent_mode()  # per-project output is interleaved otherwise
+    else:
+        set_verbose_mode()
+    if o.debug:
+        set_debug_mode()
+    if o.log_file:
+        set_log_file(o.log_file)
+    p_status(header)
+
+    if len(a) != 1:
+        p_error("Expecting a single manifest file. See --help.")
+    if o.jobs < 1:
+        p_error("Invalid value for --jobs. Expecting positive integer")
+
+    try:
+        projects = read_manifest(a[0])
+    except CheckfortException, e:
+        p_error(e)
+    if not projects:
+        p_error("No projects in manifest.")
+
+    if not os.path.isdir(o.outdir):
+        os.makedirs(o.outdir)
+
+    p_status("Running %d projects (%d at a time)"
+             % (len(projects), min(o.jobs, len(projects))))
+    pool = ThreadPool(min(o.jobs, len(projects)))
+    try:
+        summaries = pool.map(run_project,
+                             [(p, o.outdir) for p in projects], chunksize=1)
+    finally:
+        pool.close()
+
+    write_summary(summaries, o.outdir)
+    failed = [s["name"] for s in summaries if s["error"]]
+    p_status("\nAll done. View '%s' for the summary."
+             % os.path.join(o.outdir, "index.html"))
+    if failed:
+        p_error("%d project(s) failed: %s" % (len(failed), ", ".join(failed)))
+
+
+def parse_options():
+    op = OptionParser(usage=__doc__, version=header)
+    op.set_defaults(quiet=False, verbose=False, debug=False,
+                    jobs=default_jobs, outdir=outdir)
+    op.add_option("-q", "--quiet", action="store_true", dest="quiet",
+                  help="Suppress per-project output (default)")
+    op.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                  help="Print per-project progress information")
+    op.add_option("-d", "--debug", action="store_true", dest="debug",
+                  help="Print debug information")
+    op.add_option("-j", "--jobs", type="int", dest="jobs",
+                  help="Number of projects to run concurrently "
+                       "(default: %d)" % default_jobs)
+    op.add_option("-O", "--output-dir", type="string", dest="outdir",
+                  help="Directory for the summary, logs and (unless "
+                       "specified per project) project reports "
+                       "(default: %s)" % outdir)
+    op.add_option("--log-file", type="string", dest="log_file",
+                  help="Also write all messages, regardless of verbosity, "
+                       "to the given file as JSON lines")
+    return op.parse_args()
+
+
+if __name__ == "__main__":
+    main()
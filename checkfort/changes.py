@@ -0,0 +1,69 @@
+import os
+from subprocess import Popen, PIPE
+
+from checkfort.exceptions import *
+from checkfort.splitting import ModuleDependencies
+from checkfort.logging import p_info, p_verbose
+
+
+def _git(args, cwd=None):
+    """Returns the output of git args, run in cwd"""
+    try:
+        p = Popen(["git"] + args, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    except OSError, e:
+        raise CheckfortException("Could not run git - %s" % e)
+    out, err = p.communicate()
+    if p.returncode:
+        raise CheckfortException("git %s failed - %s"
+                                 % (args[0], err.strip() or p.returncode))
+    return out
+
+
+def changed_files(rev):
+    """
+    Returns set of files (relative to the current directory) changed in the
+    local git repository since rev, or rather since the merge base of rev
+    and HEAD. Uncommitted changes and untracked files are included.
+    """
+    top = _git(["rev-parse", "--show-toplevel"]).strip()
+    base = _git(["merge-base", rev, "HEAD"]).strip()
+    paths = _git(["diff", "--name-only", "-z", base, "--"], cwd=top)
+    paths += _git(["ls-files", "--others", "--exclude-standard", "-z"],
+                  cwd=top)
+    cwd = os.path.realpath(os.curdir)
+    return set(os.path.relpath(os.path.join(top, x), cwd)
+               for x in paths.split("\0") if x)
+
+
+class ChangeSet(object):
+    """
+    Selects the input files affected by the changes since a git revision:
+    the changed input files and all inputs which (indirectly) USE modules
+    defined in, or INCLUDE, any changed file.
+
+    affected are the files to report events for, required are the files to
+    pass to forcheck (affected plus the files defining the modules they
+    need). Both are in input order.
+    """
+    def __init__(self, files, rev):
+        self.rev = rev
+        changed = changed_files(rev)
+        deps = ModuleDependencies(files)
+        affected = deps.dependents(changed)
+        self.changed = [x for x in files if x in changed]
+        self.affected = [x for x in files if x in affected]
+        required = set()
+        for filename in self.affected:
+            required.update(deps.closure(filename))
+        self.required = [x for x in files if x in required]
+
+    def report(self, total):
+        """Print the selection (out of total input files)"""
+        p_info("\nSelected files changed since %s" % self.rev)
+        p_info(" - %d of %d input files changed, %d affected including "
+               "dependents, %d passed to forchk"
+               % (len(self.changed), total, len(self.affected),
+                  len(self.required)))
+        for filename in self.affected:
+            p_verbose("   %s%s" % (filename, filename not in self.changed
+                                   and " (dependent)" or ""))
@@ -0,0 +1,245 @@
+import mmap
+from bisect import bisect_right
+
+from checkfort.exceptions import *
+from checkfort.parser import ForcheckParser
+from checkfort.logging import p_info
+
+EVENT_ANCHOR = "**["
+PAGE_BREAK = "\n\f"
+
+# whitespace which may surround content on a (non page break) line
+LEADING_BLANKS = " \t\r\v"
+TRAILING_BLANKS = " \t\r\v\f"
+
+
+def find_lines(buf, needle, start, end):
+    """
+    Yields the offsets of lines within buf[start:end] which, ignoring leading
+    blanks, start with needle.
+
+    Uses str.find rather than a "^"-anchored regex as the latter has to be
+    attempted at every offset of the buffer.
+    """
+    pos = buf.find(needle, start, end)
+    while pos >= 0:
+        sol = buf.rfind("\n", 0, pos) + 1
+        if sol >= start and not buf[sol:pos].strip(LEADING_BLANKS):
+            yield sol
+        pos = buf.find(needle, pos + len(needle), end)
+
+
+def find_marker(buf, marker, start, end):
+    """
+    Returns (start, end) of the first line within buf[start:end] equal to
+    marker once stripped
+    """
+    for sol in find_lines(buf, marker, start, end):
+        eol = buf.find("\n", sol, end)
+        eol = end if eol < 0 else eol
+        if buf[sol:eol].strip(LEADING_BLANKS).rstrip(TRAILING_BLANKS) == marker:
+            return sol, eol
+    return None
+
+
+class ListfileIndex(object):
+    """
+    Page index of a memory-mapped forcheck listfile.
+
+    For each page, stores the offset of the page (its "\\f" line or the start
+    of file for the first page), the offset at which its content starts
+    (i.e. after the page header) and the target file named in the header.
+
+    pages, as returned by get_pages(), can be provided to reuse the page
+    index of a previous scan of the same file.
+
+    Content of truncated listfiles ends with the last complete line, or
+    before the last page if its header is incomplete (see self.end).
+    truncated is True if the listfile ends with an incomplete line.
+    """
+    def __init__(self, buf, pages=None):
+        self.buf = buf
+        if pages:
+            self.page_starts, self.content_starts, self.targets, \
+                self.end = pages
+            return
+
+        self.end = buf.rfind("\n") + 1
+        self.truncated = self.end < len(buf)
+        self.page_starts = []
+        self.content_starts = []
+        self.targets = []
+        if not self._add_page(0, 0):
+            raise ParseError("Empty listfile")
+        pos = buf.find(PAGE_BREAK, 0, self.end)
+        while pos >= 0:
+            header = buf.find("\n", pos + 1) + 1
+            if not self._add_page(pos + 1, header):
+                self.end = pos + 1  # truncated within page header
+                break
+            pos = buf.find(PAGE_BREAK, pos + 1, self.end)
+
+    def _readline(self, pos):
+        """Returns (line, end), or (None, pos) if no complete line at pos"""
+        end = self.buf.find("\n", pos, self.end)
+        if end < 0:
+            return None, pos
+        return self.buf[pos:end + 1], end + 1
+
+    def _add_page(self, page_start, pos):
+        """
+        Equivalent of ForcheckParser's forward_to_content(). Returns False
+        if the page header is incomplete.
+        """
+        # each new page starts with a header
+        line, pos = self._readline(pos)
+        if line is None:
+            return False
+        assert line.startswith("FORCHECK"), "Unexpected listfile format"
+
+        # this is followed by "(options...) target_file" if the output is
+        # file specific
+        line, pos = self._readline(pos)
+        if line is None:
+            return False
+        if line.strip():
+            target_file = line.rsplit(None, 1)[-1]
+            line, pos = self._readline(pos)  # following line should be blank
+            if line is None:
+                return False
+            assert not line.strip(), "Unexpected listfile format"
+        else:
+            target_file = None
+
+        self.page_starts.append(page_start)
+        self.content_starts.append(pos)
+        self.targets.append(target_file)
+        return True
+
+    def get_pages(self):
+        return (self.page_starts, self.content_starts, self.targets, self.end)
+
+    def page_of(self, pos):
+        return bisect_right(self.page_starts, pos) - 1
+
+    def in_content(self, pos):
+        return pos >= self.content_starts[self.page_of(pos)]
+
+    def segments(self, start, end):
+        """Yields (page, seg_start, seg_end) for content within [start, end)"""
+        for page in xrange(self.page_of(start), len(self.page_starts)):
+            seg_start = max(start, self.content_starts[page])
+            if page + 1 < len(self.page_starts):
+                seg_end = min(end, self.page_starts[page + 1])
+            else:
+                seg_end = end
+            if seg_start >= end:
+                break
+            if seg_start < seg_end:
+                yield page, seg_start, seg_end
+
+    def preceding_lines(self, pos, page=None, count=2):
+        """
+        Returns the count stripped content lines preceding the line which
+        starts at pos, skipping page headers. Missing lines (at the start of
+        the file) are returned as "".
+        """
+        buf = self.buf
+        if page is None:
+            page = self.page_of(pos)
+        out = []
+        while len(out) < count:
+            if pos <= self.content_starts[page]:
+                if page == 0:
+                    out.append("")
+                    continue
+                pos = self.page_starts[page]  # end of previous page
+                page -= 1
+                continue
+            start = buf.rfind("\n", 0, pos - 1) + 1
+            out.append(buf[start:pos - 1].strip())
+            pos = start
+        return out
+
+    def feed_anchors(self, parser, start, end):
+        """Feed only event lines (and the 2 lines before them) to parser"""
+        buf = self.buf
+        page_of = self.page_of
+        for pos in find_lines(buf, EVENT_ANCHOR, start, end):
+            page = page_of(pos)
+            if pos < self.content_starts[page]:  # within page header
+                continue
+            eol = buf.find("\n", pos)
+            line = buf[pos:len(buf) if eol < 0 else eol].strip()
+            line1, line2 = self.preceding_lines(pos, page)
+            parser.slurp(self.targets[page], line, line1, line2)
+
+    def feed_lines(self, parser, start, end):
+        """Feed every content line within [start, end) to parser"""
+        line1, line2 = self.preceding_lines(start)
+        for page, seg_start, seg_end in self.segments(start, end):
+            target_file = self.targets[page]
+            lines = self.buf[seg_start:seg_end].split("\n")
+            if not lines[-1]:  # segment ends with a newline
+                lines.pop()
+            for L in lines:
+                line = L.strip()
+                parser.slurp(target_file, line, line1, line2)
+                line1, line2 = line, line1
+
+
+class FastForcheckParser(ForcheckParser):
+    """
+    Parser for forcheck listfiles which memory-maps the listfile.
+
+    Page breaks, section end markers and "**[" event anchors are located
+    using scans over the whole buffer so only the lines around events
+    are ever turned into Python strings. Results are identical to those of
+    ForcheckParser.
+    """
+
+    def _scan(self, stages):
+        with open(self.listfile, "rb") as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                raise ParseError("Empty listfile - " + self.listfile)
+            try:
+                index = ListfileIndex(buf)
+                self.truncated = index.truncated
+                self._scan_buffer(index, stages)
+            finally:
+                buf.close()
+
+    def _find_sections(self, index, stages):
+        """Returns list of (stage, start, end) offsets within the buffer"""
+        sections = []
+        pos = index.content_starts[0]
+        end = index.end
+        for stage in stages:
+            if stage["end_marker"] is None:
+                sections.append((stage, pos, end))
+                break
+            match = find_marker(index.buf, stage["end_marker"], pos, end)
+            while match and not index.in_content(match[0]):
+                match = find_marker(index.buf, stage["end_marker"],
+                                    match[1], end)
+            if not match:  # remaining content belongs to this section
+                sections.append((stage, pos, end))
+                break
+            sections.append((stage, pos, match[0]))
+            pos = min(match[1] + 1, end)
+        return sections
+
+    def _scan_buffer(self, index, stages):
+        for stage, start, end in self._find_sections(index, stages):
+            stage["reached"] = True
+            p_info(" - Parsing %s" % stage["name"])
+            if stage["parser"]:
+                self._parse_section(index, stage, start, end)
+
+    def _parse_section(self, index, stage, start, end):
+        if stage["parser"].anchored:
+            index.feed_anchors(stage["parser"], start, end)
+        else:
+            index.feed_lines(stage["parser"], start, end)
@@ -2,21 +2,27 @@
 
 import os
 import re
+import json
 from time import gmtime, strftime
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 from operator import itemgetter
 
 import chardet
 
 from jinja2 import Template
 from jinja2 import Environment, PackageLoader
-from pygments import highlight
+from pygments import highlight, format as format_tokens
 from pygments.styles import get_all_styles
 from pygments.formatters import HtmlFormatter
 
 from checkfort import project_url
 from checkfort.lexer import FortranLexer
-from checkfort.logging import p_debug, p_verbose, p_info
+from checkfort.formatter import CompactFormatter
+from checkfort.output import get_sink
+from checkfort.filters import EVENT_CATEGORIES
+from checkfort.monitor import describe_resources
+from checkfort.summary import partial_reasons
+from checkfort.logging import p_debug, p_verbose, p_info, Progress
 
 jinja_env = Environment(loader=PackageLoader('checkfort', 'templates'))
 
@@ -29,6 +35,29 @@ def render(template_name, params={}):
     return get_template(template_name).render(params)
 
 
+def preload():
+    """
+    Compile all templates and the lexer's regular expressions ahead of use,
+    e.g. in a background thread while forchk runs
+    """
+    for template_name in jinja_env.list_templates():
+        get_template(template_name)
+    FortranLexer()
+
+
+# rendered style.css indexed by HtmlFormatter args. Shared by all
+# ResultWriter instances as it only depends on the formatter style.
+_stylesheets = {}
+
+
+def get_stylesheet(fmt_args):
+    key = tuple(sorted(fmt_args.iteritems()))
+    if key not in _stylesheets:
+        _stylesheets[key] = (render("style.css")
+                             + HtmlFormatter(**fmt_args).get_style_defs())
+    return _stylesheets[key]
+
+
 def bytes2unicode(data):
     # search for BOM
     for bom, encoding in (('\xef\xbb\xbf', 'utf-8'),
@@ -44,6 +73,262 @@ def bytes2unicode(data):
     return unicode(data, encoding, errors='replace')
 
 
+# For context-window source pages (see ResultWriter._format_windows()),
+# each window is lexed starting LEAD_IN_STATEMENTS statements early, looking
+# back and ahead at most MAX_LEAD_LINES lines (Fortran allows up to 255
+# continuation lines per statement).
+LEAD_IN_STATEMENTS = 2
+MAX_LEAD_LINES = 256
+FIXED_FORM_EXTENSIONS = (".f", ".for", ".ftn", ".f77")
+
+re_continued = re.compile(r"&[ \t]*(![^'\"]*)?$")  # free form
+re_fixed_continuation = re.compile(r" {5}[^ 0]| {0,4}\t[1-9]")
+re_comment_line = re.compile(r"[ \t]*(!|$)")
+re_fixed_comment_line = re.compile(r"[cC*!]|[ \t]*(!|$)")
+
+
+def lexer_bounds(source, start, end, fixed_form=False):
+    """
+    Returns (first, last) range of lines to lex for the lines start to end
+    (0-based, end exclusive) of source, a list of lines.
+
+    Tokens may span lines, e.g. continued string literals or keywords and
+    whitespace followed by newlines. So the range starts with the
+    statements before the first line and ends with the statement of the
+    first code line after the last one, skipping comment lines.
+    """
+    is_comment = (re_fixed_comment_line if fixed_form
+                  else re_comment_line).match
+    lower = max(0, start - MAX_LEAD_LINES)
+    upper = min(len(source), end + MAX_LEAD_LINES)
+
+    def continued(n):
+        """Is code line n a continuation line?"""
+        if fixed_form and re_fixed_continuation.match(source[n]):
+            return True
+        prev = n - 1
+        while prev >= lower and is_comment(source[prev]):
+            prev -= 1
+        return prev >= lower and re_continued.search(source[prev]) is not None
+
+    first, statements = start, 0
+    for n in xrange(start - 1, lower - 1, -1):
+        if statements == LEAD_IN_STATEMENTS:
+            break
+        if not is_comment(source[n]):
+            first = n
+            if not continued(n):
+                statements += 1
+
+    last = end
+    while last < upper and is_comment(source[last]):
+        last += 1
+    last += 1
+    while last < upper and (is_comment(source[last]) or continued(last)):
+        last += 1
+    return first, min(last, len(source))
+
+
+def context_windows(linenums, context, nlines):
+    """
+    Returns sorted list of (start, end) line ranges (0-based, end exclusive)
+    covering context lines either side of each line in linenums (1-based).
+    Line numbers which are not valid (e.g. 0) stand for the last line.
+    Overlapping and adjacent windows are merged.
+    """
+    windows = []
+    for n in sorted(set(x if 0 < x <= nlines else nlines
+                        for x in linenums)):
+        if not n:
+            continue  # empty file
+        start, end = max(0, n - 1 - context), min(nlines, n + context)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def split_lines(tokens):
+    """Splits a stream of pygments tokens into lists of tokens per line"""
+    line = []
+    for ttype, value in tokens:
+        parts = value.split("\n")
+        for part in parts[:-1]:
+            line.append((ttype, part + "\n"))
+            yield line
+            line = []
+        if parts[-1]:
+            line.append((ttype, parts[-1]))
+    if line:
+        yield line
+
+
+def search_key(term):
+    """Returns the name of the search index shard term belongs to"""
+    return "_".join("%x" % ord(c) for c in term[:2])
+
+
+def to_unicode(s):
+    if isinstance(s, str):
+        return unicode(s, 'utf-8', errors='replace')
+    return s
+
+
+class SearchIndex(object):
+    """
+    Inverted index from culprit symbols, filenames and event codes to event
+    instances, written as shards of JSONP (search/<key>.js) which are loaded
+    on demand by search.js. Terms are lowercased and sharded by their first
+    two characters (see search_key()).
+
+    Each shard carries its own table of the events it refers to so a lookup
+    never needs to load more than one file.
+    """
+    re_symbol = re.compile(r"[a-z_][a-z0-9_]*")
+
+    def __init__(self):
+        # key -> (event records, term -> record ids, event number -> id)
+        self.shards = defaultdict(lambda: ([], defaultdict(list), {}))
+        self.count = 0
+
+    def terms(self, instance, numeric_code):
+        """Returns set of terms event instance can be found by"""
+        terms = set(self.re_symbol.findall(instance.culprit.lower()))
+        terms.add(numeric_code)
+        if instance.filename:
+            filename = to_unicode(instance.filename).lower()
+            terms.add(filename)
+            terms.add(os.path.basename(filename))
+        return terms
+
+    def add(self, instance, link, numeric_code):
+        self.count += 1
+        record = None
+        for term in self.terms(instance, numeric_code):
+            records, postings, ids = self.shards[search_key(term)]
+            if self.count not in ids:
+                if record is None:
+                    record = [link, instance.code,
+                              to_unicode(instance.filename or ""),
+                              instance.linenum or 0,
+                              to_unicode(instance.culprit)]
+                ids[self.count] = len(records)
+                records.append(record)
+            postings[term].append(ids[self.count])
+
+    def write(self, sink, subdir="search"):
+        for key, (records, postings, ids) in self.shards.iteritems():
+            data = json.dumps({"e": records, "t": postings},
+                              separators=(',', ':'))
+            sink.write("%s/%s.js" % (subdir, key),
+                       "checkfort_search.register(%s,%s);\n"
+                       % (json.dumps(key), data))
+
+
+class Rollup(object):
+    """
+    Number of events per category and per event code in a source file or,
+    cumulatively, in a directory.
+    """
+    def __init__(self, path, link, parent=None):
+        self.path = path
+        self.name = path.rsplit("/", 1)[-1] or path
+        self.link = link
+        self.parent = parent
+        self.total = 0
+        self.lines = 0
+        self.files = 0
+        self.categories = defaultdict(int)
+        self.codes = defaultdict(int)
+        self.subdirs = []  # directory Rollups, if this is a directory
+        self.filelist = []  # file Rollups, if this is a directory
+
+    @property
+    def density(self):
+        """Events per 1000 lines"""
+        if not self.lines:
+            return 0.0
+        return 1000.0 * self.total / self.lines
+
+    @property
+    def ancestors(self):
+        """Enclosing directories, outermost first"""
+        out = []
+        parent = self.parent
+        while parent:
+            out.append(parent)
+            parent = parent.parent
+        return out[::-1]
+
+    def add(self, other):
+        self.total += other.total
+        self.lines += other.lines
+        self.files += other.files
+        for category, count in other.categories.iteritems():
+            self.categories[category] += count
+        for code, count in other.codes.iteritems():
+            self.codes[code] += count
+
+    def top_codes(self, n=3):
+        return sorted(self.codes.iteritems(), key=lambda x: (-x[1], x[0]))[:n]
+
+    def entries(self):
+        """Returns subdirectories and files, each sorted by density"""
+        by_density = lambda r: (-r.density, -r.total, r.name)
+        return (sorted(self.subdirs, key=by_density),
+                sorted(self.filelist, key=by_density))
+
+
+def build_rollups(file_events, line_counts):
+    """
+    Returns the Rollup of the directory enclosing all files in file_events,
+    with the Rollups of subdirectories and files attached.
+
+    Each event is counted once. Directory totals are then accumulated
+    bottom-up, so the cost is linear in the number of events (plus the
+    number of distinct codes per file/directory).
+    """
+    def dir_link(parts):
+        return "tree/%sindex.html" % "".join("%s/" % p.replace(' ', '_')
+                                             for p in parts)
+
+    dir_parts = dict((f, f.split("/")[:-1]) for f in file_events)
+    prefix = os.path.commonprefix(dir_parts.values()) if dir_parts else []
+    root = Rollup("/".join(prefix) or ("/" if prefix else "."), dir_link([]))
+    dirs = {(): root}
+
+    for filename, instances in file_events.iteritems():
+        parts = tuple(dir_parts[filename][len(prefix):])
+        for i in xrange(1, len(parts) + 1):  # create missing directories
+            if parts[:i] not in dirs:
+                parent = dirs[parts[:i - 1]]
+                d = Rollup("/".join(prefix + list(parts[:i])),
+                           dir_link(parts[:i]), parent)
+                dirs[parts[:i]] = d
+                parent.subdirs.append(d)
+
+        r = Rollup(filename, "src/%s.html" % filename.replace(' ', '_'),
+                   dirs[parts])
+        r.files = 1
+        r.lines = line_counts.get(filename, 0)
+        r.total = len(instances)
+        for e in instances:
+            r.codes[e.code] += 1
+        for code, count in r.codes.iteritems():
+            r.categories[code.split(None, 1)[1]] += count
+        dirs[parts].filelist.append(r)
+
+    # deepest directories first so subdirs are complete before being added
+    for parts in sorted(dirs, key=len, reverse=True):
+        d = dirs[parts]
+        for r in d.filelist:
+            d.add(r)
+        if d.parent:
+            d.parent.add(d)
+    return root
+
+
 class Event(object):
     @classmethod
     def to_url(cls, code, depth=0):
@@ -61,20 +346,44 @@ class Event(object):
 class ResultWriter(object):
     def __init__(self, parser_state, outdir,
                  line_numbers=True,
-                 formatter_style='default'):
+                 formatter_style='default',
+                 search_index=True,
+                 rollups=True,
+                 unit_pages=True,
+                 source_context=None,
+                 full_source=False,
+                 compact=False,
+                 output_format="dir",
+                 incremental=False):
         self.state = parser_state  # expect parser.ParserState instance
         self.outdir = outdir
+        self.output_format = output_format
+        self.incremental = incremental
+        self.sink = None  # set by run()
         self.line_numbers = line_numbers
+        self.search_index = search_index
+        self.rollups = rollups
+        self.unit_pages = unit_pages and len(self.state.units) > 0
+        # if not None, source pages only show source_context lines around
+        # each event. full_source then adds links to full source pages.
+        self.source_context = source_context
+        self.full_source = full_source and source_context is not None
+        self.compact = compact  # use CompactFormatter for source pages
+        self.line_counts = {}  # filled in by _format_source()
 
         self.formatter_style = formatter_style
         if not formatter_style in get_all_styles():
             raise CheckfortException("Invalid HtmlFormatter style - " + style)
 
-        # vars to supply to all HTML templates
+        # vars to supply to all HTML templates. With incremental output,
+        # only index.html shows the date so other pages do not change
+        # needlessly between runs.
+        self.gen_date = strftime("%a, %d %b %Y %H:%M:%S", gmtime())
         self.default_context = {
             "to_root": "",
-            "gen_date": strftime("%a, %d %b %Y %H:%M:%S", gmtime()),
+            "gen_date": None if incremental else self.gen_date,
             "project_url": project_url,
+            "partial": partial_reasons(self.state),
         }
 
         # default args for pygments.formatters.HtmlFormatter
@@ -86,6 +395,14 @@ class ResultWriter(object):
         if self.line_numbers:
             self.fmt_args["linenos"] = "inline"
 
+        # lexer and formatter are reused for all source files
+        self.lexer = FortranLexer(stripnl=False)
+        self.formatter = HtmlFormatter(**self.fmt_args)
+        # for context windows. linenostart is set for each window.
+        self.window_formatter = HtmlFormatter(**self.fmt_args)
+        self.compact_formatter = CompactFormatter(formatter_style,
+                                                  self.fmt_args["lineanchors"])
+
         # cache Event instances
         self.events = [
             Event(code, self.state.event_message[code], count)
@@ -93,93 +410,250 @@ class ResultWriter(object):
                                       key=itemgetter(1), reverse=True)]
 
     def run(self):
-        p_info("\nWriting HTML output to '%s'" % self.outdir)
-        if self.outdir and not os.path.isdir(self.outdir):
-            os.makedirs(self.outdir)
-
-        self._gen_assets()
-        self._gen_event_pages()
-        self._gen_source_pages()
-        self._gen_index()
+        self.sink = get_sink(self.outdir, self.output_format,
+                             self.incremental)
+        p_info("\nWriting HTML output to '%s'" % self.sink.location)
+        complete = False
+        try:
+            self._gen_assets()
+            self._gen_event_pages()
+            self._gen_source_pages()
+            if self.rollups:
+                self._gen_rollup_pages()
+            if self.unit_pages:
+                self._gen_unit_pages()
+            if self.search_index:
+                self._gen_search_index()
+            self._gen_index()
+            complete = True
+        finally:
+            self.sink.close(complete)
 
     def _gen_assets(self):
-        outfile = os.path.join(self.outdir, "style.css")
-        p_info(" - Generating %s" % outfile)
-        with open(outfile, 'w') as f:
-            f.write(render("style.css"))
-            f.write(HtmlFormatter(**self.fmt_args).get_style_defs())
+        p_info(" - Generating style.css")
+        self.sink.write("style.css", get_stylesheet(self.fmt_args))
+
+        if self.search_index:
+            p_info(" - Generating search.js")
+            self.sink.write("search.js", render("search.js"))
 
     def _gen_index(self):
-        outfile = os.path.join(self.outdir, "index.html")
-        p_info(" - Generating %s" % outfile)
+        p_info(" - Generating index.html")
 
         ctx = self.default_context.copy()
+        ctx["gen_date"] = self.gen_date
         ctx["event_summary"] = self.events
-        ctx["FCKDIR"] = os.environ["FCKDIR"]
-        ctx["FCKCNF"] = os.environ["FCKCNF"]
-        ctx["FCKPWD"] = os.environ["FCKPWD"]
+        ctx["search_index"] = self.search_index
+        ctx["rollups"] = self.rollups and bool(self.state.file_events)
+        ctx["unit_pages"] = self.unit_pages
+        ctx["FCKDIR"] = os.environ.get("FCKDIR", "")
+        ctx["FCKCNF"] = os.environ.get("FCKCNF", "")
+        ctx["FCKPWD"] = os.environ.get("FCKPWD", "")
         if hasattr(self.state, "run_data"):
             ctx.update(self.state.run_data)
+            ctx["resource_usage"] = describe_resources(
+                                        self.state.run_data.get("resources"))
+
+        self.sink.write("index.html", render("index.html", ctx))
 
-        with open(outfile, 'w') as f:
-            f.write(render("index.html", ctx))
+    def _gen_search_index(self):
+        p_info(" - Generating search index")
+        index = SearchIndex()
+        for e in self.events:
+            event_link = Event.to_url(e.code)
+            for instance in self.state.event_instances[e.code]:
+                index.add(instance, instance.link or event_link,
+                          e.numeric_code)
+        index.write(self.sink)
 
     def _gen_event_pages(self):
         depth = 1
-        eventdir = os.path.join(self.outdir, "event")
         p_info(" - Generating event summaries")
 
-        if not os.path.isdir(eventdir):
-            os.makedirs(eventdir)
-
         ctx = self.default_context.copy()
         ctx["to_root"] = "../" * depth
         for e in self.events:
-            outfile = "%s/%s.html" % (eventdir, e.code.replace(' ', '_'))
             ctx["event"] = e
-            ctx["event_instances"] = self.state.event_instances[e.code]
-            with open(outfile, 'w') as f:
-                f.write(render("event.html", ctx))
+            ctx["event_files"], ctx["global_instances"] = (
+                self.state.grouped_instances(e.code))
+            self.sink.write(e.link, render("event.html", ctx))
 
     def _gen_source_pages(self):
         p_info(" - Generating marked-up source files")
+        progress = Progress("source files", len(self.state.file_events))
+        for filename in self.state.file_events:
+            full_link = None
+            if self.full_source:
+                full_link = os.path.basename(
+                                self._gen_source_page(filename, full=True))
+            subpath = self._gen_source_page(filename, full_link=full_link)
+            p_verbose("   -- %s" % subpath)
+            progress.step()
+        progress.done()
+
+    def _gen_source_page(self, filename, full=False, full_link=None):
+        """Writes source page of filename. Returns its path"""
+        ctx = self.default_context.copy()
+        ctx["code_block"], subpath, depth = self._format_source(filename, full)
+        ctx["to_root"] = "../" * depth
+        ctx["filename"] = filename
+        ctx["source_context"] = None if full else self.source_context
+        ctx["line_counters"] = self.compact and self.line_numbers
+        ctx["full_link"] = full_link
+        self.sink.write(subpath, render("code_source.html", ctx))
+        return subpath
+
+    def _gen_rollup_pages(self):
+        p_info(" - Generating directory summaries")
+        root = build_rollups(self.state.file_events, self.line_counts)
+
         ctx = self.default_context.copy()
-        for filename, event_instances in self.state.file_events.iteritems():
-            ctx["code_block"], subpath, depth = self._format_source(filename)
-            outfile = os.path.join(self.outdir, subpath)
-            p_verbose("   -- %s" % outfile)
-
-            ctx["to_root"] = "../" * depth
-            ctx["filename"] = filename
-            outdir = os.path.dirname(outfile)
-            if outdir and not os.path.isdir(outdir):
-                os.makedirs(outdir)
-
-            with open(outfile, 'w') as f:
-                f.write(render("code_source.html", ctx).encode('utf-8'))
-
-    def _format_source(self, filename):
-        """returns (formatted_code, target_filename, depth)"""
-        outfile = os.path.join("src", "%s.html" % filename.replace(' ', '_'))
+        ctx["categories"] = EVENT_CATEGORIES
+        pending = [root]
+        while pending:
+            d = pending.pop()
+            pending.extend(d.subdirs)
+            ctx["to_root"] = "../" * d.link.count('/')
+            ctx["dir"] = d
+            self.sink.write(d.link, render("tree.html", ctx))
+
+    def _gen_unit_pages(self):
+        depth = 1
+        p_info(" - Generating program unit cross-references")
+        graph = self.state.units
+        if not graph.has_references():
+            graph.add_source_references()
+
+        units = []
+        for uid, name in enumerate(graph.names):
+            filename = graph.files[uid]
+            units.append({
+                "name": name,
+                "kind": graph.kinds[uid] or "",
+                "file": filename,
+                "file_link": (filename in self.state.file_events
+                              and "src/%s.html" % filename.replace(' ', '_')),
+                "link": "units/%s.html" % name.lower(),
+                "uses": graph.dependencies(name),
+                "used_by": graph.dependents(name, transitive=False),
+                "dependents": graph.dependents(name),
+            })
+        units.sort(key=lambda u: u["name"].lower())
+
+        ctx = self.default_context.copy()
+        ctx["units"] = units
+        ctx["to_root"] = "../" * depth
+        self.sink.write("units/index.html", render("units.html", ctx))
+
+        for unit in units:
+            ctx["unit"] = unit
+            self.sink.write(unit["link"], render("unit.html", ctx))
+
+    def _format_source(self, filename, full=False):
+        """
+        returns (formatted_code, target_filename, depth)
+
+        If self.source_context is set, only lines around events are included
+        unless full is True (for the <name>.full.html pages).
+        """
+        windowed = self.source_context is not None and not full
+        outfile = os.path.join("src", "%s%s.html"
+                               % (filename.replace(' ', '_'),
+                                  ".full" if full else ""))
         depth = outfile.count('/')
-        to_root = "../" * depth
-        # get HTML formatted source as list of lines
         with open(filename, 'r') as f:
-            lexer = FortranLexer(stripnl=False)
-            formatter = HtmlFormatter(**self.fmt_args)
+            text = bytes2unicode(f.read())
+        if windowed:
+            lines, index = self._format_windows(filename, text)
+        elif self.compact:
+            lines = self.compact_formatter.format_lines(
+                            split_lines(self.lexer.get_tokens(text)))
+            self.line_counts[filename] = len(lines)
+            index = dict((n, n - 1) for n in xrange(1, len(lines) + 1))
+        else:
+            # get HTML formatted source as list of lines
             lines = re.findall(r'<a name="line-\d+"></a>.*\n',
-                               highlight(bytes2unicode(f.read()),
-                                         lexer, formatter))
-
-        # append events to target lines
-        for e in self.state.file_events[filename]:
-            lines[e.linenum - 1] += (
+                               highlight(text, self.lexer, self.formatter))
+            self.line_counts[filename] = len(lines)
+            index = dict((n, n - 1) for n in xrange(1, len(lines) + 1))
+
+        # append events to target lines. Events without a valid line number
+        # (e.g. 0 if forcheck gave none) go on the last line.
+        nlines = self.line_counts[filename]
+        if not nlines:
+            lines.append("")
+            index[0] = 0
+        for linenum, events in self.state.file_lines(filename):
+            if not 0 < linenum <= nlines:
+                linenum = nlines
+            lines[index[linenum]] += "".join(
                 "<span class='e-line'>  "
                 "<a href='%s' class='e-link'>[%s]</a> "
                 "<span class='e-label'>%s</span>: "
                 "<span class='e-message'>%s</span>"
                 "</span>\n" % (Event.to_url(e.code, depth),
                                e.code.rjust(5), e.culprit,
-                               self.state.event_message[e.code]))
+                               self.state.event_message[e.code])
+                for e in events)
 
         return ("".join(lines), outfile, depth)
+
+    def _format_windows(self, filename, text):
+        """
+        Returns (lines, index): HTML formatted lines of the windows of
+        self.source_context lines around events, separated by markers for
+        the lines left out, and a dict of line numbers to positions in lines.
+
+        Each window is lexed on its own, along with the statements around it
+        (see lexer_bounds()) and after a newline, as lines in the middle of a
+        file are. The lexer is then in the same state at the start of the
+        window as when lexing the full file. Only the window is formatted.
+        """
+        source = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        if source[-1] == "":
+            source.pop()
+        nlines = len(source)
+        fixed_form = (os.path.splitext(filename)[1].lower()
+                      in FIXED_FORM_EXTENSIONS)
+        self.line_counts[filename] = nlines
+
+        lines, index = [], {}
+        shown = 0  # lines up to here are either shown or marked as skipped
+        for start, end in context_windows(self.state.line_index[filename],
+                                          self.source_context, nlines):
+            if start > shown:
+                lines.append(self._skip_marker(shown, start))
+            lex_start, lex_end = lexer_bounds(source, start, end, fixed_form)
+            chunk = "\n".join(source[lex_start:lex_end]) + "\n"
+            skip = start - lex_start
+            if lex_start:
+                chunk = "\n" + chunk
+                skip += 1
+            tokens = list(split_lines(self.lexer.get_tokens(chunk)))
+            for n, line in enumerate(self._format_lines(
+                                        tokens[skip:skip + end - start],
+                                        start + 1), start + 1):
+                index[n] = len(lines)
+                lines.append(line)
+            shown = end
+        if shown < nlines:
+            lines.append(self._skip_marker(shown, nlines))
+        return lines, index
+
+    def _format_lines(self, token_lines, linenum):
+        """
+        Returns list of HTML formatted lines for token_lines (see
+        split_lines()), the first of which is line linenum
+        """
+        if self.compact:
+            return self.compact_formatter.format_lines(token_lines, linenum)
+        self.window_formatter.linenostart = linenum
+        return re.findall(r'<a name="line-\d+"></a>.*\n',
+                          format_tokens([t for line in token_lines
+                                         for t in line],
+                                        self.window_formatter))
+
+    def _skip_marker(self, start, end):
+        return ("<span class='e-skip'>  [%s not shown]</span>\n"
+                % ("line %d" % end if end - start == 1
+                   else "lines %d-%d" % (start + 1, end)))
@@ -1,6 +1,8 @@
 import os
 import re
 import sys
+from itertools import imap
+from multiprocessing.pool import ThreadPool
 from checkfort.exceptions import *
 from checkfort.logging import p_warn, p_verbose
 
@@ -20,8 +22,16 @@ class InputFileReader(object):
 
 
 class FileList(object):
-    def __init__(self, entries=None, extensions=default_extensions):
+    """
+    Input files found in entries (files or directories to search).
+
+    With jobs > 1, entries are searched concurrently using a pool of jobs
+    threads. Files, messages and errors are still reported in the order of
+    the entries, so the results are the same as with a sequential search.
+    """
+    def __init__(self, entries=None, extensions=default_extensions, jobs=1):
         self.files = []
+        self.jobs = jobs
         # build regex from extension list
         if not extensions:
             raise CheckfortException("Invalid extensions list - " + extensions)
@@ -33,30 +43,51 @@ class FileList(object):
 
     def add_files(self, entries):
         if isinstance(entries, basestring):
-            self._add(entries)
+            entries = [entries]
+        if self.jobs > 1 and len(entries) > 1:
+            pool = ThreadPool(min(self.jobs, len(entries)))
+            try:
+                found = pool.map(self._find, entries, chunksize=1)
+            finally:
+                pool.close()
         else:
-            for entry in entries:
-                self._add(entry)
+            found = imap(self._find, entries)  # stops at the first error
+        for files, messages, error in found:
+            for report, msg in messages:
+                report(msg)
+            if error:
+                raise error
+            self.files.extend(files)
+
+    def _find(self, entry):
+        """
+        Returns (files, messages, error) for entry, where messages is a list
+        of (function, message) to report and error is an exception to raise
+        (or None). Prints nothing, so it can run in any thread.
+        """
+        files, messages = [], []
+        try:
+            if os.path.isdir(entry):
+                messages.append((p_verbose,
+                                 " - Searching for files in %s" % entry))
+                for root, dirs, names in os.walk(os.path.relpath(entry)):
+                    for f in names:
+                        if self.re_extensions.match(f):
+                            self._check(os.path.join(root, f), files,
+                                        messages)
+            else:
+                self._check(entry, files, messages)
+        except CheckfortException, e:
+            return files, messages, e
+        return files, messages, None
 
-    def _check_and_add(self, filename):
+    def _check(self, filename, files, messages):
         if not os.path.exists(filename):
             if os.path.islink(filename):
-                p_warn("Warning: ignoring broken sym link - (%s)" % filename)
+                messages.append((p_warn, "Warning: ignoring broken sym link "
+                                         "- (%s)" % filename))
                 return
             else:
                 raise CheckfortException("Invalid path - " + filename)
         assert(not os.path.isdir(filename))
-        self.files.append(os.path.relpath(filename))
-
-    def _add(self, entry):
-        if os.path.isdir(entry):
-            self._search_dir(entry)
-        else:
-            self._check_and_add(entry)
-
-    def _search_dir(self, directory):
-        p_verbose(" - Searching for files in %s" % directory)
-        for root, dirs, files in os.walk(os.path.relpath(directory)):
-            for f in files:
-                if self.re_extensions.match(f):
-                    self._check_and_add(os.path.join(root, f))
+        files.append(os.path.relpath(filename))
@@ -0,0 +1,106 @@
+import re
+from fnmatch import fnmatch
+
+from checkfort.exceptions import *
+
+EVENT_CATEGORIES = ("I", "E", "W", "O")
+
+
+class EventFilter(object):
+    """
+    Decides which forcheck events should be dropped while parsing.
+
+    Events can be dropped by numeric code, by category (I/E/W/O), by
+    filename (glob pattern) or by culprit (regex), or restricted to a set of
+    files (see restrict_files()). Patterns are compiled once
+    and decisions for codes and filenames are cached, so the per-event cost is
+    a dict lookup in the common case.
+    """
+    def __init__(self, codes=None, categories=None, files=None,
+                 culprits=None):
+        self.codes = set(int(x) for x in (codes or ()))
+
+        self.categories = set(x.strip().upper() for x in (categories or ()))
+        invalid = self.categories.difference(EVENT_CATEGORIES)
+        if invalid:
+            raise CheckfortException("Invalid event categories - %s. "
+                                     "Possible options: %s"
+                                     % (", ".join(sorted(invalid)),
+                                        ", ".join(EVENT_CATEGORIES)))
+
+        self.file_patterns = list(files or ())
+
+        self.culprit_patterns = list(culprits or ())
+        if self.culprit_patterns:
+            try:
+                self.re_culprits = re.compile("|".join(
+                    "(?:%s)" % x for x in self.culprit_patterns))
+            except re.error, e:
+                raise CheckfortException("Invalid culprit regex - %s" % e)
+        else:
+            self.re_culprits = None
+
+        self.only_files = None
+        self._code_cache = {}
+        self._file_cache = {}
+
+    def __nonzero__(self):
+        return bool(self.codes or self.categories or self.file_patterns
+                    or self.culprit_patterns or self.only_files is not None)
+
+    def restrict_files(self, filenames):
+        """Drop events reported against any file not in filenames"""
+        self.only_files = set(filenames)
+        self._file_cache.clear()
+
+    def drops_code(self, code):
+        """True if all events with the given code (e.g. "557 I") are dropped"""
+        try:
+            return self._code_cache[code]
+        except KeyError:
+            numeric, category = code.split(None, 1)
+            dropped = (int(numeric) in self.codes
+                       or category in self.categories)
+            self._code_cache[code] = dropped
+            return dropped
+
+    def drops_file(self, filename):
+        """True if events reported against filename are dropped"""
+        if filename is None or (not self.file_patterns
+                                and self.only_files is None):
+            return False
+        try:
+            return self._file_cache[filename]
+        except KeyError:
+            dropped = ((self.only_files is not None
+                        and filename not in self.only_files)
+                       or any(fnmatch(filename, p)
+                              for p in self.file_patterns))
+            self._file_cache[filename] = dropped
+            return dropped
+
+    def drops_culprit(self, culprit):
+        """True if events with the given culprit/details are dropped"""
+        if self.re_culprits is None or not culprit:
+            return False
+        return bool(self.re_culprits.search(culprit))
+
+    def describe(self):
+        """Returns list of human readable descriptions of active filters"""
+        out = []
+        if self.codes:
+            out.append("codes: %s" % ", ".join(str(x)
+                                               for x in sorted(self.codes)))
+        if self.categories:
+            out.append("categories: %s" % ", ".join(sorted(self.categories)))
+        if self.file_patterns:
+            out.append("files: %s" % ", ".join(self.file_patterns))
+        if self.culprit_patterns:
+            out.append("culprits: %s" % ", ".join(self.culprit_patterns))
+        if self.only_files is not None:
+            shown = sorted(self.only_files)[:5]
+            more = len(self.only_files) - len(shown)
+            out.append("only files: %s%s" % (", ".join(shown),
+                                              more and " and %d more" % more
+                                              or ""))
+        return out
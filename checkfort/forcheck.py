@@ -1,15 +1,21 @@
 import os
 import re
 import sys
+import json
+import time
+import shutil
+import signal
 import pexpect
+import threading
 import subprocess
 from tempfile import mkstemp
 from glob import glob1 as sieve
 
 from checkfort.exceptions import *
 from checkfort.parser import ForcheckParser
-from checkfort.logging import p_info, p_verbose, p_warn, p_error
-from checkfort.logging import verbose_enabled
+from checkfort.logging import p_info, p_verbose, p_warn
+from checkfort.logging import Progress
+from checkfort.monitor import ProcessMonitor
 
 # we support only version 14.2 and above
 #  - versions before 14.1 has a slightly different output format
@@ -29,26 +35,117 @@ SUPPORTED_STANDARDS = {"77": "-f77",
                        "2003": "-f03",
                        "2008": "-f08"}
 
+RC_OVERFLOW = 6
+RC_ABORTED = -1  # forchk stopped by checkfort (see Forcheck.run())
+
 EXIT_CODES = {
+    RC_ABORTED: "stopped before completion, results are partial",
     0: "no informative, warning, overflow or error messages presented",
     2: "informative, but no warning, overflow or error messages presented",
     4: "warning, but no overflow or error messages presented",
-    6: "table overflow, but no error messages presented",
+    RC_OVERFLOW: "table overflow, but no error messages presented",
     8: "error messages presented"}
 
+# exit codes of forchk runs which completed without a table overflow
+RC_COMPLETE = (0, 2, 4, 8)
+
+# seconds between checks of the time and memory limits of forchk runs
+POLL_INTERVAL = 1.0
+
+# seconds forchk is given to exit after SIGTERM before it is killed
+KILL_GRACE = 10.0
+
+# Results of probe_forcheck() indexed by $FCKDIR: (installation, error).
+# Shared by all Forcheck instances so forchk is only located and probed once
+# per process. Installations are reported (printed) once, by the first
+# Forcheck instance using them.
+_installations = {}
+_installations_lock = threading.Lock()
+_reported = set()
+
+
+def probe_forcheck(fdir):
+    """
+    Locate forchk and the *.cnf files within fdir and detect the forcheck
+    version. Results (and errors) are cached, so this can be called ahead
+    of time, e.g. in a background thread while input files are searched.
+    Prints nothing.
+
+    returns (forcheck_exe, cnfdir, supported_emulators, forcheck_version)
+    """
+    with _installations_lock:
+        if fdir not in _installations:
+            try:
+                _installations[fdir] = (_probe_forcheck(fdir), None)
+            except CheckfortException, e:
+                _installations[fdir] = (None, e)
+        installation, error = _installations[fdir]
+    if error:
+        raise error
+    return installation
+
+
+def _probe_forcheck(fdir):
+    # locate exe
+    candidates = map(lambda x: os.path.join(fdir, x, "forchk"),
+                        ("bin", "."))
+    try:
+        found = (x for x in candidates if os.path.isfile(x)).next()
+    except StopIteration:
+        raise CheckfortException("Could not find 'forchk' binary")
+    forcheck_exe = os.path.realpath(os.path.join(fdir, found))
+
+    # locate g95.cnf and assume all cnf files are in the same dir
+    candidates = map(lambda x: os.path.join(fdir, x, "g95.cnf"),
+                        ("share/forcheck", "."))
+    try:
+        found = (x for x in candidates if os.path.isfile(x)).next()
+    except StopIteration:
+        raise CheckfortException("Could not find '*.cnf' files")
+    cnfdir = os.path.dirname(os.path.join(fdir, found))
+
+    # detect list of supported emulators
+    supported_emulators = [x[:-4] for x in sieve(cnfdir, "*.cnf")]
+
+    # guess version number by doing a trial run of forchk
+    try:
+        child = subprocess.Popen([forcheck_exe, "-batch"],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+    except:
+        raise CheckfortException("Could not run " + forcheck_exe)
+
+    # extract version string from output header
+    first_line = child.communicate()[0].split("\n", 1)[0]
+    last_col = first_line.rsplit(None, 1)[1]
+    try:
+        ver = re.match(r"V(\d+)\.(\d+)\.(\d+)", last_col).groups()
+        forcheck_version = map(int, ver)
+    except AttributeError:
+        raise CheckfortException(
+            forcheck_exe + " not producing expected output")
+
+    return (forcheck_exe, cnfdir, supported_emulators, forcheck_version)
+
 
 class Forcheck(object):
     def __init__(self, input_files,
                  fortran_standard="95",
                  emulate_compiler="gfortran",
-                 free_format=False, extra_opts=None):
+                 free_format=False, extra_opts=None,
+                 time_limit=None, memory_limit=None):
         self.rc = None
+        self.resources = None  # set by run()
+        self.aborted = None  # reason forchk was stopped, set by run()
+        self.time_limit = time_limit  # seconds
+        self.memory_limit = memory_limit  # bytes
         self.input_files = input_files
         self.extra_opts = extra_opts
 
         # create tempfile file for use as staging area for forcheck .lst file
         tmp_fd, self.tmpfile = mkstemp(suffix=".lst")
         os.close(tmp_fd)
+        self.keep_tmpfile = False  # set by save_listfile()
 
         # The following are set by call to self._locate_forcheck()
         self.supported_emulators = []
@@ -74,17 +171,44 @@ class Forcheck(object):
                                      "Possible options: "
                                      + ", ".join(self.supported_emulators))
         self.emulate_compiler = emulate_compiler
-        os.environ["FCKCNF"] = os.path.join(self.cnfdir,
-                                            "%s.cnf" % emulate_compiler)
+        self.fckcnf = os.path.join(self.cnfdir, "%s.cnf" % emulate_compiler)
+        # set FCKCNF for the forchk child only, so instances with different
+        # emulations can run concurrently
+        self.env = dict(os.environ, FCKCNF=self.fckcnf)
         p_info(" - compiler emilation: %s" % emulate_compiler)
 
     def __del__(self):
+        if self.keep_tmpfile:
+            return
         if self.tmpfile and os.path.isfile(self.tmpfile):
             os.unlink(self.tmpfile)
 
     def get_tmp_filename(self):
         return self.tmpfile
 
+    def save_listfile(self, path, logfile=None):
+        """
+        Move the forcheck listfile to path so it is kept once this instance
+        is deleted. The run data is written to path.json and, if given, a
+        copy of logfile to path.log. (See load_run_data())
+
+        Returns path.
+        """
+        run_data = self.get_run_data()
+        parent = os.path.dirname(path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        shutil.move(self.tmpfile, path)
+        self.tmpfile = path
+        self.keep_tmpfile = True
+
+        with open(path + ".json", "w") as f:
+            json.dump(run_data, f, indent=1)
+        if logfile and os.path.isfile(logfile):
+            shutil.copy(logfile, path + ".log")
+        p_info("\nForcheck listfile saved to %s" % path)
+        return path
+
     def _locate_forcheck(self):
         """
         Detect required environment variables (FCKDIR, FCKCNF).
@@ -92,10 +216,9 @@ class Forcheck(object):
         From those values, locate forchk binary and detects list of supported
         compiler emulators.
 
-        sets self.cnfdir, self.forcheck_exe and self.supported_emulators
+        sets self.cnfdir, self.forcheck_exe, self.supported_emulators and
+        self.forcheck_version
         """
-        p_info("\nLocating forcheck")
-
         if "FCKPWD" not in os.environ:
             raise CheckfortException("FCKPWD environment var not set")
 
@@ -104,56 +227,24 @@ class Forcheck(object):
         except KeyError:
             raise CheckfortException("FCKDIR environment var not set")
 
-        # locate exe
-        candidates = map(lambda x: os.path.join(fdir, x, "forchk"),
-                            ("bin", "."))
-        try:
-            found = (x for x in candidates if os.path.isfile(x)).next()
-        except StopIteration:
-            raise CheckfortException("Could not find 'forchk' binary")
-        self.forcheck_exe = os.path.realpath(os.path.join(fdir, found))
-
-        # locate g95.cnf and assume all cnf files are in the same dir
-        candidates = map(lambda x: os.path.join(fdir, x, "g95.cnf"),
-                            ("share/forcheck", "."))
-        try:
-            found = (x for x in candidates if os.path.isfile(x)).next()
-        except StopIteration:
-            raise CheckfortException("Could not find '*.cnf' files")
-        self.cnfdir = os.path.dirname(os.path.join(fdir, found))
-
-        # detect list of supported emulators
-        self.supported_emulators = [x[:-4] for x in sieve(self.cnfdir,
-                                                          "*.cnf")]
-
-        # guess version number by doing a trial run of forchk
-        try:
-            child = subprocess.Popen([self.forcheck_exe, "-batch"],
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-        except:
-            raise CheckfortException("Could not run " + self.forcheck_exe)
-
-        # extract version string from output header
-        first_line = child.communicate()[0].split("\n", 1)[0]
-        last_col = first_line.rsplit(None, 1)[1]
-        try:
-            ver = re.match(r"V(\d+)\.(\d+)\.(\d+)", last_col).groups()
-            self.forcheck_version = map(int, ver)
-        except AttributeError:
-            raise CheckfortException(
-                self.forcheck_exe + " not producing expected output")
-
-        p_info(" - install dir: %s" % fdir)
-        p_info(" - executable: %s" % self.forcheck_exe)
-        p_info(" - version: %s" % ".".join(str(v)
-                                                 for v in self.get_version()))
+        with _installations_lock:
+            report = fdir not in _reported
+            _reported.add(fdir)
+        if report:
+            p_info("\nLocating forcheck")
+        (self.forcheck_exe, self.cnfdir, self.supported_emulators,
+         self.forcheck_version) = probe_forcheck(fdir)
+        if report:
+            p_info(" - install dir: %s" % fdir)
+            p_info(" - executable: %s" % self.forcheck_exe)
+            p_info(" - version: %s" % ".".join(str(v) for v in
+                                               self.forcheck_version))
 
         # compare min version
         min_ver = tuple(int(x) for x in MIN_VESION.split("."))
         if tuple(self.forcheck_version[:2]) < min_ver[:2]:
-            p_error("Unsupported Forcheck version "
-                    "(version >=%s expected)." % MIN_VESION)
+            raise CheckfortException("Unsupported Forcheck version "
+                                     "(version >=%s expected)." % MIN_VESION)
 
     def get_arguments(self):
         args = DEFAULT_ARGS[:]
@@ -178,11 +269,10 @@ class Forcheck(object):
         if line.startswith("-- "):
             if line.startswith("-- file: "):
                 p_verbose("    - %s" % line.split(None, 2)[2])
+                self._progress.step()
             elif not line.startswith("-- commandline") and \
                     not line.startswith("-- messages presented"):
                 p_verbose(line)
-            if not verbose_enabled():
-                p_info(".", "")
 
         elif line.startswith("FCK-- "):
             err = line.split(None, 1)[1]
@@ -191,8 +281,8 @@ class Forcheck(object):
                 filename = ""  # not specified
             p_warn("%s - %s %s\n" % (err, culprit, filename))
 
-        elif not verbose_enabled() and line.startswith("- file"):
-            p_info(".", "")
+        elif line.startswith("- file"):
+            self._progress.step()
 
         self._store_prev = (line, self._store_prev[0])
 
@@ -203,27 +293,89 @@ class Forcheck(object):
             "command": " ".join(self.get_command()),
             "version_string": "Forcheck version %s" % \
                               ".".join(str(x) for x in self.get_version()),
+            "FCKCNF": self.fckcnf,
+            "FCKDIR": os.environ.get("FCKDIR", ""),
+            "FCKPWD": os.environ.get("FCKPWD", ""),
+            "resources": self.resources,
+            "aborted": self.aborted,
         }
 
-    def run(self):
-        out = "forcheck.log"
+    def run(self, out="forcheck.log"):
         p_info("\nRunning forcheck (stdout written to %s)" % out)
         with open(out, "w") as fout:
             # use pexpect.spawn instead of subprocess.Popen so we can get
             # real-time output from forcheck (Popen is subject to stdout being
             # buffered when redirected to PIPE).
             cmd = self.get_command()
-            child = pexpect.spawn(cmd[0], args=cmd[1:], logfile=fout)
+            child = pexpect.spawn(cmd[0], args=cmd[1:], logfile=fout,
+                                  env=self.env)
             self._store_prev = ("", "")
+            self._progress = Progress("files analysed",
+                                      len(self.input_files))
+            monitor = ProcessMonitor(child.pid).start()
             while True:
+                self.aborted = self._check_limits(monitor)
+                if self.aborted:
+                    self._stop(child)
+                    break
                 try:
-                    child.expect('\n')
+                    child.expect('\n', timeout=POLL_INTERVAL)
                     self._report_runtime_message(child.before)
+                except pexpect.TIMEOUT:
+                    continue
                 except pexpect.EOF:
                     break
+            # stop before child is reaped by close() so final CPU times
+            # can still be read
+            self.resources = monitor.stop()
             child.close()
-            self.rc = child.exitstatus
+            self.rc = RC_ABORTED if self.aborted else child.exitstatus
+            self._progress.done()
+        self.resources["files"] = len(self.input_files)
+        if os.path.isfile(self.tmpfile):
+            self.resources["listfile_size"] = os.path.getsize(self.tmpfile)
+        if self.aborted:
+            # keep what forchk managed to write
+            self.keep_tmpfile = True
+            p_warn("Forcheck stopped (%s). Partial listfile kept in %s"
+                   % (self.aborted, self.tmpfile))
+            return
         try:
             p_info("\nDONE. (rc=%d, %s)" % (self.rc, EXIT_CODES[self.rc]))
         except KeyError:
-            p_error("FAILED (rc=%d). See %s for details" % (self.rc, out))
+            raise CheckfortException("FAILED (rc=%d). See %s for details"
+                                     % (self.rc, out))
+
+    def _check_limits(self, monitor):
+        """Returns reason to stop forchk if a limit is exceeded, else None"""
+        if self.time_limit and \
+                time.time() - monitor.start_time > self.time_limit:
+            return "time limit of %d s exceeded" % self.time_limit
+        if self.memory_limit and monitor.peak_rss > self.memory_limit:
+            return ("memory limit of %d MiB exceeded"
+                    % (self.memory_limit // (1024 * 1024)))
+        return None
+
+    def _stop(self, child):
+        """Send SIGTERM to forchk, then SIGKILL if it does not exit"""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            child.kill(sig)
+            deadline = time.time() + KILL_GRACE
+            while time.time() < deadline:
+                if not child.isalive():
+                    return
+                time.sleep(0.1)
+
+
+def load_run_data(listfile):
+    """
+    Returns run data saved alongside listfile by Forcheck.save_listfile(),
+    or an empty dict if there is none.
+    """
+    try:
+        with open(listfile + ".json") as f:
+            return json.load(f)
+    except IOError:
+        return {}
+    except ValueError:
+        raise CheckfortException("Invalid run data - %s.json" % listfile)
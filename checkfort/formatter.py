@@ -0,0 +1,87 @@
+from pygments.token import STANDARD_TYPES
+from pygments.styles import get_style_by_name
+
+
+def css_class(ttype):
+    """Returns the CSS class pygments' HtmlFormatter uses for ttype"""
+    suffix = ""
+    while ttype not in STANDARD_TYPES:
+        suffix = "-" + ttype[-1] + suffix
+        ttype = ttype.parent
+    return STANDARD_TYPES[ttype] + suffix
+
+
+def escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class CompactFormatter(object):
+    """
+    Formats lines of pygments tokens as compact HTML, using the stylesheet
+    of pygments' HtmlFormatter (see HtmlFormatter.get_style_defs()).
+
+    Compared to HtmlFormatter, each line is only preceded by an empty anchor
+    (<a id=line-N></a>) and line numbers are left to CSS counters (see
+    style.css). Tokens the style does not highlight get no span, adjacent
+    tokens of the same class (and whitespace between them) share a single
+    span, and attribute values are not quoted.
+    """
+    def __init__(self, style="default", lineanchors="line"):
+        self.style = get_style_by_name(style)
+        self.lineanchors = lineanchors
+        self.classes = {}  # token type -> CSS class, or None if not styled
+
+    def token_class(self, ttype):
+        try:
+            return self.classes[ttype]
+        except KeyError:
+            styled = any(self.style.style_for_token(ttype).itervalues())
+            cls = self.classes[ttype] = styled and css_class(ttype) or None
+            return cls
+
+    def format_lines(self, token_lines, linenum=1):
+        """
+        Returns list of HTML lines for token_lines (lists of (ttype, value)
+        tokens per line, see filegen.split_lines()), the first of which is
+        line linenum
+        """
+        out = []
+        for n, tokens in enumerate(token_lines, linenum):
+            if n == linenum and n > 1:
+                # counters start at 1 otherwise (see style.css)
+                anchor = "<a id=%s-%d style='counter-reset:line %d'></a>" % (
+                            self.lineanchors, n, n - 1)
+            else:
+                anchor = "<a id=%s-%d></a>" % (self.lineanchors, n)
+            out.append("%s%s\n" % (anchor, self.format_line(tokens)))
+        return out
+
+    def format_line(self, tokens):
+        parts = []
+        current, text, space = None, [], ""  # open span, its text, pending
+
+        def close():
+            if current:
+                parts.append("<span class=%s>%s</span>"
+                             % (current, escape("".join(text))))
+            elif text:
+                parts.append(escape("".join(text)))
+
+        for ttype, value in tokens:
+            value = value.rstrip("\n")
+            if not value:
+                continue
+            cls = self.token_class(ttype)
+            if cls is None and not value.strip():
+                space += value  # merged into the span around it, if any
+            elif cls == current:
+                text.extend((space, value))
+                space = ""
+            else:
+                close()
+                if space:
+                    parts.append(space)
+                current, text, space = cls, [value], ""
+        close()
+        parts.append(space)
+        return "".join(parts)
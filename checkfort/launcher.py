@@ -4,6 +4,8 @@
 %prog [OPTIONS] dirs...         # Run forcheck on source files in dirs
 %prog [OPTIONS] -I SOURCE_FILE  # Load files/dirs from SOURCE_FILES as input
 %prog [OPTIONS] (any combination of the above three)
+%prog [OPTIONS] --from-listfile LISTFILE  # Regenerate report from LISTFILE
+%prog [OPTIONS] --from-listfile L1 --from-listfile L2 ...  # Merge listfiles
 
 %prog [-h|--help]               # Display program options
 %prog [--version]               # Display version information
@@ -11,20 +13,41 @@
 import os
 import sys
 import shlex
+from time import time
 from optparse import OptionParser
 from checkfort.exceptions import *
-from checkfort.forcheck import SUPPORTED_STANDARDS, Forcheck
+from checkfort.forcheck import SUPPORTED_STANDARDS, Forcheck, load_run_data
+from checkfort.forcheck import probe_forcheck
 from checkfort import __version__ as version
 from checkfort.logging import set_silent_mode, set_verbose_mode, set_debug_mode
+from checkfort.logging import set_log_file
 from checkfort.logging import p_info, p_debug, p_verbose, p_warn, p_error
+from checkfort.logging import p_status
 from checkfort.files import InputFileReader, FileList, default_extensions
 from checkfort.parser import ForcheckParser
-from checkfort.filegen import ResultWriter
+from checkfort.fastparser import FastForcheckParser
+from checkfort.parallel import ParallelForcheckParser
+from checkfort.merge import ListfileMerger
+from checkfort.monitor import record_throughput, describe_resources
+from checkfort.filters import EventFilter
+from checkfort.filegen import ResultWriter, preload
+from checkfort.startup import Startup
+from checkfort.changes import ChangeSet
+from checkfort.output import OUTPUT_FORMATS, INCREMENTAL_FORMATS
+from checkfort.splitting import OverflowSplitter, PARTITION_CACHE
+from checkfort.summary import Thresholds, format_summary
+from checkfort.summary import RC_THRESHOLD_EXCEEDED, RC_PARTIAL
+from checkfort.summary import partial_reasons
 
 outdir = "cfort_html"
 supported_standards = SUPPORTED_STANDARDS.keys()
 default_standard = "95"
 default_emulation = "gfortran"
+parsers = {"line": ForcheckParser,
+           "fast": FastForcheckParser,
+           "parallel": ParallelForcheckParser}
+default_parse_mode = "fast"
+discovery_jobs = 8  # threads searching input directories
 header = "CheckFort (Version %s)" % version
 
 
@@ -33,8 +56,44 @@ def main():
 
     cleaned = {}  # store validated input options
     cleaned["outdir"] = o.outdir
+    cleaned["output_format"] = o.output_format
+    cleaned["incremental"] = bool(o.incremental)
+    if cleaned["incremental"] and o.output_format not in INCREMENTAL_FORMATS:
+        p_error("--incremental can only be used with --output-format=%s"
+                % " or ".join(INCREMENTAL_FORMATS))
+    if o.source_context is not None and o.source_context < 0:
+        p_error("Invalid value for --source-context. Expecting non-negative "
+                "integer")
+    cleaned["source_context"] = o.source_context
+    if o.full_source and o.source_context is None:
+        p_error("--full-source can only be used with --source-context")
+    cleaned["full_source"] = bool(o.full_source)
+    cleaned["compact_html"] = bool(o.compact_html)
     cleaned["pretend"] = bool(o.pretend)
+    cleaned["logfile"] = "forcheck.log"
+    # kept next to the report, so projects run from the same directory
+    # into different output directories don't share it
+    cleaned["partition_cache"] = os.path.normpath(o.outdir) + PARTITION_CACHE
     cleaned["extra_opts"] = shlex.split(o.extra_opts or "")
+    cleaned["parse_mode"] = o.parse_mode
+    if o.parse_jobs is not None and o.parse_jobs < 1:
+        p_error("Invalid value for --parse-jobs. Expecting positive integer")
+    cleaned["parse_jobs"] = o.parse_jobs
+    cleaned["split_on_overflow"] = bool(o.split_on_overflow)
+    if o.split_jobs is not None and o.split_jobs < 1:
+        p_error("Invalid value for --split-jobs. Expecting positive integer")
+    cleaned["split_jobs"] = o.split_jobs
+    cleaned["summary_only"] = bool(o.summary_only)
+    cleaned["profile"] = bool(o.profile)
+    if o.time_limit is not None and o.time_limit < 1:
+        p_error("Invalid value for --time-limit. Expecting positive integer")
+    cleaned["time_limit"] = o.time_limit
+    if o.memory_limit is not None and o.memory_limit < 1:
+        p_error("Invalid value for --memory-limit. Expecting positive "
+                "integer")
+    cleaned["memory_limit"] = o.memory_limit and o.memory_limit * 1024 * 1024
+    cleaned["save_listfile"] = o.save_listfile
+    cleaned["from_listfiles"] = o.from_listfiles or []
 
     # --compiler-emulation can only be checked once Forcheck is found.
     # Accept anything for now
@@ -47,6 +106,8 @@ def main():
         set_verbose_mode()
     if o.debug:
         set_debug_mode()
+    if o.log_file:
+        set_log_file(o.log_file)
 
     # Once output verbosity set, we can print the output header
     p_info("%s" % header)
@@ -74,11 +135,67 @@ def main():
         p_error("Invalid value for --ignore-err-codes (-i). "
                 "Expecting comma-separated list of numeric values")
 
+    # check --ignore-categories, --ignore-files and --ignore-culprits
+    cleaned["ignore_categories"] = [x.strip() for x in
+                                    o.ignore_categories.split(",")
+                                    if x.strip()]
+    cleaned["ignore_files"] = [x.strip() for x in o.ignore_files.split(",")
+                               if x.strip()]
+    cleaned["ignore_culprits"] = o.ignore_culprits or []
+    try:
+        cleaned["event_filter"] = EventFilter(
+                                    codes=cleaned["ignore_list"],
+                                    categories=cleaned["ignore_categories"],
+                                    files=cleaned["ignore_files"],
+                                    culprits=cleaned["ignore_culprits"])
+    except CheckfortException, e:
+        p_error(e)
+
+    # check --fail-on (comma separated KEY=COUNT entries)
+    try:
+        cleaned["thresholds"] = Thresholds(o.fail_on)
+    except CheckfortException, e:
+        p_error("Invalid value for --fail-on. %s" % e)
+
+    # --from-listfile reuses the results of a previous run. No inputs needed.
+    if cleaned["from_listfiles"]:
+        if cleaned["save_listfile"] or cleaned["split_on_overflow"]:
+            p_error("--from-listfile cannot be used with --save-listfile "
+                    "or --split-on-overflow")
+        if cleaned["pretend"]:
+            p_error("--from-listfile cannot be used with --pretend")
+        if o.changed_since:
+            p_error("--from-listfile cannot be used with --changed-since")
+        if a or o.input_file:
+            p_warn("Input files ignored when using --from-listfile")
+        for listfile in cleaned["from_listfiles"]:
+            if not os.path.isfile(listfile):
+                p_error("Listfile not readable: %s" % listfile)
+        cleaned["files"] = []
+        try:
+            state = do_action(cleaned)
+        except CheckfortException, e:
+            p_error(e)
+        check_results(cleaned, state)
+        return
+
+    if cleaned["save_listfile"] and cleaned["split_on_overflow"]:
+        p_error("--save-listfile cannot be used with --split-on-overflow")
+
+    # Probe forchk and load templates in the background while searching for
+    # input files. Errors are reported when forchk is first used, as before.
+    startup = Startup()
+    if "FCKDIR" in os.environ and "FCKPWD" in os.environ:
+        startup.submit("forcheck probe", probe_forcheck, os.environ["FCKDIR"])
+    startup.submit("templates and lexer", preload)
+
     # read target files form positional args and --input-file option
     targets = a[:]  # get targets from arguments
     if o.input_file:  # get targets from file specified with --input-file
         try:
-            targets.extend(InputFileReader(o.input_file).get_entries())
+            targets.extend(startup.timed("input file",
+                                         lambda: InputFileReader(o.input_file)
+                                                   .get_entries()))
         except IOError:
             p_error("Input file not readable: %s" % o.input_file)
     if not targets:
@@ -95,7 +212,8 @@ def main():
         p_info("Searching directories for files with the following "
                   "extensions : %s" % " ".join("*.%s" % x for x in ext_list))
     try:
-        filelist = FileList(targets,  ext_list)
+        filelist = startup.timed("file search", FileList, targets, ext_list,
+                                 discovery_jobs)
     except CheckfortException, e:
         p_error(e)
 
@@ -103,47 +221,162 @@ def main():
         p_error("No relevant input files found.")
     cleaned["files"] = filelist.files
 
+    # only check files affected by changes since --changed-since
+    changes = None
+    if o.changed_since:
+        try:
+            changes = startup.timed("changed files", ChangeSet,
+                                    filelist.files, o.changed_since)
+        except CheckfortException, e:
+            p_error(e)
+    startup.finish()
+    if changes:
+        changes.report(len(filelist.files))
+        if not changes.affected:
+            p_info("\nNo input files affected. Nothing to check.")
+            return
+        cleaned["files"] = changes.required
+        cleaned["event_filter"].restrict_files(changes.affected)
+
     # do actual work
     try:
-        do_action(cleaned)
+        state = do_action(cleaned)
     except CheckfortException, e:
         p_error(e)
+    check_results(cleaned, state)
+
+
+def check_results(params, state):
+    """
+    Exit with RC_THRESHOLD_EXCEEDED if --fail-on limits are exceeded, or
+    RC_PARTIAL if the results are incomplete.
+    """
+    if params["thresholds"]:
+        exceeded = params["thresholds"].check(state)
+        if exceeded:
+            p_warn("Event thresholds exceeded: %s" % "; ".join(exceeded))
+            sys.exit(RC_THRESHOLD_EXCEEDED)
+    reasons = partial_reasons(state)
+    if reasons:
+        p_warn("Results are partial: %s" % "; ".join(reasons))
+        sys.exit(RC_PARTIAL)
 
 
 def do_action(params):
-    f = Forcheck(params["files"],
-                 fortran_standard=params["standard"],
-                 emulate_compiler=params["emulation"],
-                 free_format=params["free_format"],
-                 extra_opts=params["extra_opts"])
+    """
+    Run forcheck, parse its output and write the report.
+
+    Returns the resulting ParserState.
+    """
+    forcheck_args = {"fortran_standard": params["standard"],
+                     "emulate_compiler": params["emulation"],
+                     "free_format": params["free_format"],
+                     "extra_opts": params["extra_opts"],
+                     "time_limit": params["time_limit"],
+                     "memory_limit": params["memory_limit"]}
 
-    if params["pretend"]:
-        print " ".join(f.get_command())
-        sys.exit(0)
+    parser_args = {"event_filter": params["event_filter"]}
+    if (params["summary_only"] and not params["split_on_overflow"]
+            and len(params["from_listfiles"]) < 2):
+        # only counts are needed. (Merging the results of split runs or
+        # multiple listfiles relies on the event instances.)
+        parser_args["keep_instances"] = False
+    if params["parse_mode"] == "parallel":
+        parser_args["jobs"] = params["parse_jobs"]
 
-    # run forcheck
-    f.run()
-    forcheck_output = f.get_tmp_filename()  # file deleted by f.__del__()
+    parse_time = [0.0]  # total time spent parsing listfiles
 
-    # parse
-    parser = ForcheckParser(forcheck_output, ignore_list=params["ignore_list"])
+    def parse(forcheck_output):
+        start = time()
+        parser = parsers[params["parse_mode"]](forcheck_output, **parser_args)
+        parse_time[0] += time() - start
+        return parser.state
+
+    if len(params["from_listfiles"]) > 1:
+        # merge listfiles (and run data) saved by previous runs
+        start = time()
+        merger = ListfileMerger(params["from_listfiles"],
+                                parsers[params["parse_mode"]], parser_args,
+                                jobs=params["parse_jobs"])
+        state, run_data = merger.run()
+        parse_time[0] = time() - start
+    elif params["from_listfiles"]:
+        # reuse the listfile (and run data) saved by a previous run
+        listfile = params["from_listfiles"][0]
+        p_info("\nUsing forcheck results from %s" % listfile)
+        state = parse(listfile)
+        run_data = load_run_data(listfile)
+    elif params["split_on_overflow"] and not params["pretend"]:
+        # run forcheck, splitting the input if tables overflow
+        splitter = OverflowSplitter(params["files"], parse,
+                                    jobs=params["split_jobs"],
+                                    cache_file=params["partition_cache"],
+                                    logfile=params["logfile"],
+                                    **forcheck_args)
+        state, run_data = splitter.run()
+    else:
+        f = Forcheck(params["files"], **forcheck_args)
+
+        if params["pretend"]:
+            p_status(" ".join(f.get_command()))
+            sys.exit(0)
+
+        # run forcheck
+        f.run(out=params["logfile"])
+        forcheck_output = f.get_tmp_filename()  # file deleted by f.__del__()
+        if params.get("save_listfile"):  # ... unless saved
+            forcheck_output = f.save_listfile(params["save_listfile"],
+                                              params["logfile"])
+
+        # parse
+        state = parse(forcheck_output)
+        run_data = f.get_run_data()
 
     # result state
-    state = parser.state
-    state.run_data = f.get_run_data()
+    state.run_data = run_data
+    resources = run_data.get("resources")
+    if resources:
+        resources["parse_time"] = parse_time[0]
+        record_throughput(resources, sum(state.event_counter.itervalues()))
 
-    # generate output
-    writer = ResultWriter(parser.state, params["outdir"])
-    writer.run()
+    if params["summary_only"]:
+        p_status(format_summary(state))
+    else:
+        # generate output
+        start = time()
+        writer = ResultWriter(state, params["outdir"],
+                              source_context=params["source_context"],
+                              full_source=params["full_source"],
+                              compact=params["compact_html"],
+                              output_format=params["output_format"],
+                              incremental=params["incremental"])
+        writer.run()
+        if resources:
+            resources["report_time"] = time() - start
+        p_info("\nAll done. %s" % writer.sink.index_hint())
 
-    p_info("\nAll done. View '%s/index.html' for results." % params["outdir"])
+    if params["profile"]:
+        rows = describe_resources(resources)
+        if not rows:
+            p_status("\nProfile: no resource data (forchk not run or not "
+                     "monitored)")
+        else:
+            p_status("\nProfile:")
+        for label, value in rows:
+            p_status("  %-26s %s" % (label + ":", value))
+    return state
 
 
 def parse_options():
     op = OptionParser(usage=__doc__, version=header)
     op.set_defaults(quiet=False, verbose=False, debug=False, free_form=False,
+                    split_on_overflow=False, summary_only=False, fail_on="",
+                    profile=False, incremental=False, full_source=False,
+                    compact_html=False,
                     standard=default_standard, outdir=outdir, ignore="",
-                    emulation=default_emulation)
+                    ignore_categories="", ignore_files="",
+                    emulation=default_emulation,
+                    parse_mode=default_parse_mode, output_format="dir")
     op.add_option("-q", "--quiet", action="store_true", dest="quiet",
                   help="Suppress program output")
     op.add_option("-v", "--verbose", action="store_true", dest="verbose",
@@ -170,12 +403,115 @@ def parse_options():
     op.add_option("-i", "--ignore-err-codes", type="string", dest="ignore",
                   help="Comma-separated ist of error codes to ignore. "
                        "For example: --ignore-err-codes='234,153,9'")
+    op.add_option("--ignore-categories", type="string",
+                  dest="ignore_categories",
+                  help="Comma-separated list of event categories to ignore "
+                       "(I, E, W or O). For example: --ignore-categories=I,O")
+    op.add_option("--ignore-files", type="string", dest="ignore_files",
+                  help="Comma-separated list of glob patterns. Events "
+                       "reported against matching files are ignored. "
+                       "For example: --ignore-files='src/vendor/*'")
+    op.add_option("--ignore-culprits", action="append", type="string",
+                  dest="ignore_culprits",
+                  help="Ignore events whose culprit matches the given "
+                       "regular expression. Can be specified multiple times.")
     op.add_option("-o", "--extra-options", type="string", dest="extra_opts",
                    help="Pass extra options to forcheck. (Note that some "
                         "options changes forcheck's output which may affect "
                         "checkfort's ability to parse the results.)")
     op.add_option("-O", "--output-dir", type="string", dest="outdir",
                   help="Change output directory (default: %s)" % outdir)
+    op.add_option("--output-format", type="choice", dest="output_format",
+                  choices=OUTPUT_FORMATS,
+                  help="Write the report as a directory ('dir'), a directory "
+                       "of precompressed .gz files ('gzip') or straight into "
+                       "a single 'zip' or 'tar.gz' archive named after the "
+                       "output directory. (default: dir)")
+    op.add_option("--incremental", action="store_true", dest="incremental",
+                  help="Only rewrite files whose content changed since the "
+                       "last --incremental run into the same output "
+                       "directory, and remove files no longer part of the "
+                       "report. The generation date is then only shown on "
+                       "index.html. Useful when publishing reports with "
+                       "rsync.")
+    op.add_option("--source-context", type="int", dest="source_context",
+                  help="Only include the given number of lines before and "
+                       "after each event in the marked-up source files, "
+                       "instead of the full files. Keeps reports of large "
+                       "files with few events small.")
+    op.add_option("--full-source", action="store_true", dest="full_source",
+                  help="With --source-context, also write the full marked-up "
+                       "source files and link to them")
+    op.add_option("--compact-html", action="store_true", dest="compact_html",
+                  help="Use compact markup for the marked-up source files "
+                       "(CSS line numbers, fewer and shorter tags). Makes "
+                       "them several times smaller.")
+    op.add_option("--parse-mode", type="choice", dest="parse_mode",
+                  choices=sorted(parsers.keys()),
+                  help="Method used to parse the forcheck listfile. 'fast' "
+                       "memory-maps the file and only inspects lines around "
+                       "events. 'parallel' does the same using multiple "
+                       "processes. 'line' reads the file line by line. "
+                       "(default: %s)" % default_parse_mode)
+    op.add_option("--parse-jobs", type="int", dest="parse_jobs",
+                  help="Number of processes to use with --parse-mode="
+                       "parallel or when merging listfiles (default: number "
+                       "of CPUs)")
+    op.add_option("--split-on-overflow", action="store_true",
+                  dest="split_on_overflow",
+                  help="If forcheck reports a table overflow, rerun it on "
+                       "smaller sets of files (split along module "
+                       "dependencies) and merge the results. The partition "
+                       "size that worked is remembered (in OUTDIR%s) for "
+                       "subsequent runs." % PARTITION_CACHE)
+    op.add_option("--split-jobs", type="int", dest="split_jobs",
+                  help="Number of concurrent forcheck runs when using "
+                       "--split-on-overflow (default: number of CPUs)")
+    op.add_option("--time-limit", type="int", dest="time_limit",
+                  help="Stop forchk if it runs for longer than the given "
+                       "number of seconds. Results found so far are "
+                       "reported as partial results and the exit status "
+                       "is %d." % RC_PARTIAL)
+    op.add_option("--memory-limit", type="int", dest="memory_limit",
+                  help="Stop forchk if its memory use (RSS) exceeds the "
+                       "given number of MiB. As for --time-limit, results "
+                       "found so far are reported as partial results.")
+    op.add_option("--summary-only", action="store_true", dest="summary_only",
+                  help="Do not generate HTML output. Only print the number "
+                       "of events per event code and category.")
+    op.add_option("--profile", action="store_true", dest="profile",
+                  help="Print resources used by forchk (time, CPU, peak "
+                       "memory), listfile size, throughput and time spent "
+                       "parsing and generating the report.")
+    op.add_option("--fail-on", type="string", dest="fail_on",
+                  help="Exit with status %d if event counts exceed the given "
+                       "comma-separated list of KEY=COUNT limits, where KEY "
+                       "is an event category (I, E, W, O), a numeric event "
+                       "code or 'total'. For example: --fail-on='E=0,W=10'"
+                       % RC_THRESHOLD_EXCEEDED)
+    op.add_option("--save-listfile", type="string", dest="save_listfile",
+                  help="Keep the forcheck listfile at the given path, along "
+                       "with the run data (PATH.json) and forcheck log "
+                       "(PATH.log), for use with --from-listfile.")
+    op.add_option("--from-listfile", action="append", type="string",
+                  dest="from_listfiles",
+                  help="Do not run forcheck. Instead, regenerate the report "
+                       "from a listfile kept with --save-listfile. If given "
+                       "multiple times, the listfiles are parsed concurrently "
+                       "(see --parse-jobs) and merged into one report. "
+                       "Events found in several listfiles are reported once.")
+    op.add_option("--changed-since", type="string", dest="changed_since",
+                  metavar="REV",
+                  help="Only check input files changed in the local git "
+                       "repository since REV (a commit, branch or tag; "
+                       "compared from where HEAD diverged from it), "
+                       "including uncommitted and untracked files, and the "
+                       "input files which USE or INCLUDE them. Events are "
+                       "only reported for those files.")
+    op.add_option("--log-file", type="string", dest="log_file",
+                  help="Also write all messages, regardless of verbosity, "
+                       "to the given file as JSON lines (with timestamps, "
+                       "process and thread)")
     op.add_option("-I", "--input-file", type="string", dest="input_file",
                   help="Provide a file which contains a list of files/dirs "
                        "to use as input.")
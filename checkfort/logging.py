@@ -1,9 +1,33 @@
+"""
+Console output for checkfort.
+
+Output written to stdout is buffered and flushed at most every
+FLUSH_INTERVAL seconds when stdout is not a terminal (e.g. on CI, where
+each flush can be expensive). Warnings, errors and debug output go to
+stderr unbuffered, after any pending stdout output. All functions can be
+used from multiple threads; worker processes write unbuffered.
+
+Optionally, every message is also recorded in a log file as JSON lines
+(see set_log_file()).
+"""
+import os
 import sys
+import json
+import time
+import atexit
+import threading
+
+FLUSH_INTERVAL = 1.0  # seconds
+PROGRESS_INTERVAL = 5.0  # seconds
 
 _debug = False
 _verbose = False
 _info = True
 
+_lock = threading.RLock()
+_main_pid = os.getpid()
+_log_fd = None  # set by set_log_file()
+
 
 def set_silent_mode(silent=True):
     global _verbose, _info
@@ -29,29 +53,247 @@ def verbose_enabled():
     return _verbose
 
 
+class BufferedOutput(object):
+    """
+    Buffer for sys.stdout.
+
+    Data is written out once FLUSH_INTERVAL seconds have passed since the
+    last flush. A background thread ensures buffered output does not
+    linger while nothing else is being written. If buffered is None,
+    output is buffered only if stdout is not a terminal.
+    """
+    def __init__(self, buffered=None):
+        self.buffered = buffered
+        self.chunks = []
+        self.last_flush = time.time()
+        self.flusher = None
+
+    def is_buffered(self):
+        if os.getpid() != _main_pid:
+            return False  # don't risk losing output of worker processes
+        if self.buffered is None:
+            isatty = getattr(sys.stdout, "isatty", None)
+            self.buffered = not (isatty and isatty())
+        return self.buffered
+
+    def write(self, data):
+        data = _encode(data, sys.stdout)
+        if os.getpid() != _main_pid:
+            _write_unlocked(sys.stdout, data)
+            return
+        with _lock:
+            self.chunks.append(data)
+            if not self.is_buffered():
+                self.flush()
+            elif time.time() - self.last_flush >= FLUSH_INTERVAL:
+                self.flush()
+            elif self.flusher is None:
+                self._start_flusher()
+
+    def flush(self):
+        if os.getpid() != _main_pid:
+            return  # buffered output belongs to the main process
+        with _lock:
+            if self.chunks:
+                sys.stdout.write("".join(self.chunks))
+                sys.stdout.flush()
+            self.chunks = []
+            self.last_flush = time.time()
+
+    def _start_flusher(self):
+        def flush_periodically():
+            try:
+                while True:
+                    time.sleep(FLUSH_INTERVAL)
+                    self.flush()
+            except Exception:  # interpreter shutting down
+                pass
+
+        self.flusher = threading.Thread(target=flush_periodically,
+                                        name="checkfort-log-flusher")
+        self.flusher.daemon = True
+        self.flusher.start()
+
+
+_out = BufferedOutput()
+atexit.register(_out.flush)
+
+
+def set_buffered_mode(buffered=True):
+    """
+    Enable (or disable) buffering of stdout output. None restores the
+    default, i.e. buffer if stdout is not a terminal.
+    """
+    _out.flush()
+    _out.buffered = buffered
+
+
+def flush():
+    _out.flush()
+
+
+def set_log_file(filename):
+    """
+    Record all messages (regardless of verbosity) in filename, one JSON
+    object per line, with the fields: time, level, pid, thread, msg.
+    Progress records also include the fields done, total and rate.
+    """
+    global _log_fd
+    if _log_fd is not None:
+        os.close(_log_fd)
+        _log_fd = None
+    if filename:
+        # each record is a single write to an O_APPEND file descriptor so
+        # records from threads and worker processes are never interleaved
+        _log_fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                          0644)
+
+
+def _text(msg):
+    """Returns msg as unicode. Byte strings are assumed to be UTF-8"""
+    if isinstance(msg, unicode):
+        return msg
+    try:
+        return str(msg).decode("utf-8", "replace")
+    except UnicodeEncodeError:  # e.g. exception with a unicode message
+        return unicode(msg)
+
+
+def _encode(data, stream):
+    """Returns data as bytes, in the encoding of stream (UTF-8 if unknown)"""
+    if isinstance(data, unicode):
+        return data.encode(getattr(stream, "encoding", None) or "utf-8",
+                           "replace")
+    return data
+
+
+def _record(level, msg, **fields):
+    if _log_fd is None:
+        return
+    fields.update({
+        "time": round(time.time(), 3),
+        "level": level,
+        "pid": os.getpid(),
+        "thread": threading.current_thread().name,
+        "msg": _text(msg).strip("\n"),
+    })
+    os.write(_log_fd, json.dumps(fields, sort_keys=True) + "\n")
+
+
+def _stdout(msg, endl):
+    _out.write("%s%s" % (msg, endl))
+
+
+def _write_unlocked(stream, data):
+    """
+    Write data from a worker process. _lock is not used, as another thread
+    (e.g. the flusher) may have held it when the process was forked.
+    """
+    stream.write(data)
+    stream.flush()
+
+
+def _stderr(msg):
+    if os.getpid() != _main_pid:
+        _write_unlocked(sys.stderr, _encode(msg, sys.stderr))
+        return
+    with _lock:
+        _out.flush()  # preserve order of stdout and stderr output
+        sys.stderr.write(_encode(msg, sys.stderr))
+        sys.stderr.flush()
+
+
 def p_debug(msg, endl="\n"):
     if _debug:
-        sys.stderr.write("(DEBUG) %s%s" % (msg, endl))
-        sys.stderr.flush()
+        _record("debug", msg)
+        _stderr("(DEBUG) %s%s" % (msg, endl))
 
 
 def p_verbose(msg, endl="\n"):
+    if endl:
+        _record("verbose", msg)
     if _verbose:
-        sys.stdout.write("%s%s" % (msg, endl))
-        sys.stdout.flush()
+        _stdout(msg, endl)
 
 
 def p_info(msg, endl="\n"):
+    if endl:
+        _record("info", msg)
     if _info:
-        sys.stdout.write("%s%s" % (msg, endl))
-        sys.stdout.flush()
+        _stdout(msg, endl)
+
+
+def p_status(msg):
+    """Print msg. Unlike p_info, not affected by silent mode"""
+    _record("status", msg)
+    _stdout(msg, "\n")
 
 
 def p_warn(msg, endl="\n"):
-    sys.stderr.write("(Warning) %s%s" % (msg, endl))
-    sys.stderr.flush()
+    _record("warning", msg)
+    _stderr("(Warning) %s%s" % (_text(msg), endl))
 
 
 def p_error(msg, rc=100, endl="\n"):
-    sys.stderr.write("(Error) %s%s" % (msg, endl))
+    _record("error", msg)
+    _stderr("(Error) %s%s" % (_text(msg), endl))
     sys.exit(rc)
+
+
+class Progress(object):
+    """
+    Reports progress of a task working through total items, at most once
+    every interval seconds, e.g.
+
+       source files: 120/500 (40.0/s, ETA 0:10)
+
+    Nothing is printed for tasks that finish within the first interval.
+    """
+    def __init__(self, label, total=None, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.start = self.last = time.time()
+        self.reported = False
+
+    def step(self, n=1):
+        with _lock:
+            self.count += n
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self._report(now)
+
+    def done(self):
+        """Print final report (if there were intermediate ones)"""
+        if self.reported:
+            self._report(time.time(), final=True)
+
+    def _report(self, now, final=False):
+        self.reported = True
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.count / elapsed
+        msg = "   %s: %d" % (self.label, self.count)
+        if self.total:
+            msg += "/%d" % self.total
+        if final:
+            msg += " (%.1f/s, %s elapsed)" % (rate, _hms(elapsed))
+        elif self.total and rate > 0:
+            msg += " (%.1f/s, ETA %s)" % (rate,
+                                          _hms((self.total - self.count)
+                                               / rate))
+        else:
+            msg += " (%.1f/s)" % rate
+        _record("progress", msg, done=self.count, total=self.total,
+                rate=round(rate, 3))
+        if _info:
+            _stdout(msg, "\n")
+
+
+def _hms(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
@@ -0,0 +1,119 @@
+import multiprocessing
+from collections import defaultdict
+
+from checkfort.exceptions import *
+from checkfort.forcheck import EXIT_CODES, load_run_data
+from checkfort.parser import ParserState, event_key
+from checkfort.monitor import combine_resources
+from checkfort.fastparser import FastForcheckParser
+from checkfort.parallel import ParallelForcheckParser
+from checkfort.logging import p_info, p_verbose, p_warn
+
+
+def _parse_listfile(args):
+    parser_class, listfile, parser_args = args
+    return parser_class(listfile, **parser_args).state
+
+
+class ListfileMerger(object):
+    """
+    Parses several forcheck listfiles (concurrently, using up to jobs
+    processes) and merges the results into a single ParserState.
+
+    Events reported in more than one listfile, i.e. with the same file,
+    line, code and culprit, are kept once. Identical events reported
+    several times within one listfile are kept as often as they appear in
+    any single listfile.
+    """
+    def __init__(self, listfiles, parser_class, parser_args=None, jobs=None):
+        self.listfiles = listfiles
+        self.jobs = min(jobs or multiprocessing.cpu_count(), len(listfiles))
+        self.parser_class = parser_class
+        self.parser_args = dict(parser_args or {})
+        if self.parser_args.get("keep_instances") is False:
+            raise CheckfortException("Merging listfiles requires event "
+                                     "instances")
+        if self.jobs > 1 and issubclass(parser_class, ParallelForcheckParser):
+            # listfiles are already parsed concurrently, and pool workers
+            # cannot start processes of their own
+            self.parser_class = FastForcheckParser
+            self.parser_args.pop("jobs", None)
+
+    def run(self):
+        """Returns (ParserState, run_data)"""
+        p_info("\nParsing %d forcheck listfiles" % len(self.listfiles))
+        tasks = [(self.parser_class, x, self.parser_args)
+                 for x in self.listfiles]
+        if self.jobs > 1:
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                partial_states = pool.map(_parse_listfile, tasks, chunksize=1)
+            finally:
+                pool.terminate()
+        else:
+            partial_states = [_parse_listfile(x) for x in tasks]
+
+        state = self._merge(partial_states)
+        return state, self._merge_run_data()
+
+    def _merge(self, partial_states):
+        p_info("\nMerging results of %d listfiles" % len(partial_states))
+        state = ParserState(partial_states[0].legacy_mode,
+                            event_filter=partial_states[0].event_filter)
+        seen = {}  # event key -> number of instances kept so far
+        sums = defaultdict(int)
+        duplicates = 0
+        for listfile, partial in zip(self.listfiles, partial_states):
+            if partial.debug_required:
+                p_warn("Parsed events do not match the forcheck summary "
+                       "of %s" % listfile)
+            unique = self._unique_events(partial, seen)
+            duplicates += (sum(partial.event_counter.itervalues())
+                           - sum(unique.event_counter.itervalues()))
+            state.merge(unique)
+            for name, total in partial.sums.iteritems():
+                sums[name] += int(total)
+        p_verbose(" - dropped %d duplicate events" % duplicates)
+
+        # Forcheck totals are summed over all listfiles, so they exceed the
+        # number of merged events if duplicates were dropped.
+        state.sums = dict((k, str(v)) for k, v in sums.iteritems())
+        return state
+
+    def _unique_events(self, partial, seen):
+        """
+        Returns ParserState with the events of partial which are not already
+        in seen (a dict of event keys to number of instances), and updates
+        seen accordingly.
+        """
+        local = defaultdict(int)
+
+        def keep(code, e):
+            key = event_key(code, e)
+            local[key] += 1
+            return local[key] > seen.get(key, 0)
+
+        out = partial.subset(keep)
+        for key, count in local.iteritems():
+            if count > seen.get(key, 0):
+                seen[key] = count
+        return out
+
+    def _merge_run_data(self):
+        """Combines run data saved alongside the listfiles, if any"""
+        runs = [load_run_data(x) for x in self.listfiles]
+        run_data = {"merged_listfiles": len(self.listfiles)}
+        for data in runs:
+            for k, v in data.iteritems():
+                run_data.setdefault(k, v)
+
+        codes = [data["rc"] for data in runs if data.get("rc") is not None]
+        if codes:
+            run_data["rc"] = max(codes)
+            run_data["rc_message"] = EXIT_CODES.get(max(codes), "")
+        commands = [data["command"] for data in runs if data.get("command")]
+        if commands:
+            run_data["command"] = "\n".join(commands)
+        run_data["resources"] = combine_resources(data.get("resources")
+                                                  for data in runs)
+        return run_data
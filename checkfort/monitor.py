@@ -0,0 +1,156 @@
+import os
+import time
+import resource
+import threading
+
+
+class ProcessMonitor(object):
+    """
+    Samples the CPU time and peak memory use (resident set size) of a
+    running process every interval seconds, in a background thread.
+
+    Uses /proc/<pid>. CPU times remain readable until the process is
+    reaped, so stop() should be called after the process has exited but
+    before it is waited for. Without /proc, CPU times are taken from
+    getrusage(RUSAGE_CHILDREN), which also counts any other child
+    processes that finished in the meantime, and the peak RSS is unknown.
+    """
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.procdir = "/proc/%d" % pid
+        self.has_proc = os.path.isdir(self.procdir)
+        self.clock_ticks = float(os.sysconf("SC_CLK_TCK"))
+        self.user_time = self.system_time = 0.0
+        self.peak_rss = None  # bytes
+        self.start_time = self.end_time = None
+        self._rusage = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.start_time = time.time()
+        if not self.has_proc:
+            self._rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            return self
+        self._thread = threading.Thread(target=self._run,
+                                        name="checkfort-monitor-%d" % self.pid)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling. Returns resource usage (see usage())"""
+        self.end_time = time.time()
+        if self._thread:
+            self._stopped.set()
+            self._thread.join()
+            self.sample()
+        elif self._rusage:
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.user_time = after.ru_utime - self._rusage.ru_utime
+            self.system_time = after.ru_stime - self._rusage.ru_stime
+        return self.usage()
+
+    def usage(self):
+        """
+        Returns dict with wall_time, user_time, system_time, cpu_time (all
+        in seconds) and peak_rss (bytes, or None if not known)
+        """
+        end = self.end_time or time.time()
+        return {
+            "wall_time": end - (self.start_time or end),
+            "user_time": self.user_time,
+            "system_time": self.system_time,
+            "cpu_time": self.user_time + self.system_time,
+            "peak_rss": self.peak_rss,
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.sample()
+            self._stopped.wait(self.interval)
+
+    def sample(self):
+        try:
+            with open(os.path.join(self.procdir, "stat")) as f:
+                # fields after the command name (which may contain spaces)
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(os.path.join(self.procdir, "status")) as f:
+                status = f.read()
+        except (IOError, IndexError):  # process gone
+            return
+        self.user_time = int(fields[11]) / self.clock_ticks
+        self.system_time = int(fields[12]) / self.clock_ticks
+        for line in status.splitlines():
+            # VmHWM is the peak RSS. It disappears once the process exits.
+            if line.startswith("VmHWM:") or line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+                if rss > self.peak_rss:
+                    self.peak_rss = rss
+
+
+def combine_resources(resources):
+    """
+    Combine resource usage of several runs. CPU times and sizes are summed.
+    The wall time and peak RSS are the maxima of all runs, as runs may be
+    concurrent. Callers which know the elapsed time of all runs should use
+    that as the wall time instead.
+    """
+    resources = [x for x in resources if x]
+    if not resources:
+        return None
+    out = {}
+    for r in resources:
+        for key, value in r.iteritems():
+            if value is None:
+                out.setdefault(key, None)
+            elif key in ("peak_rss", "wall_time"):
+                out[key] = max(out.get(key), value)
+            else:
+                out[key] = (out.get(key) or 0) + value
+    return out
+
+
+def record_throughput(resources, events):
+    """Add number of events, and events and files per second of run time"""
+    resources["events"] = events
+    wall_time = resources.get("wall_time")
+    if wall_time:
+        resources["events_per_second"] = events / wall_time
+        resources["files_per_second"] = resources.get("files", 0) / wall_time
+
+
+def _size(nbytes):
+    if nbytes < 1024:
+        return "%d bytes" % nbytes
+    for unit in ("KiB", "MiB", "GiB"):
+        nbytes /= 1024.0
+        if nbytes < 1024 or unit == "GiB":
+            return "%.1f %s" % (nbytes, unit)
+
+
+def describe_resources(resources):
+    """Returns list of (label, value) strings describing resources"""
+    out = []
+    r = resources or {}
+    if r.get("wall_time") is not None:
+        out.append(("forchk wall time", "%.2f s" % r["wall_time"]))
+    if r.get("cpu_time") is not None:
+        out.append(("forchk CPU time", "%.2f s (user %.2f s, system %.2f s)"
+                    % (r["cpu_time"], r["user_time"], r["system_time"])))
+    if r.get("peak_rss") is not None:
+        out.append(("forchk peak memory (RSS)", _size(r["peak_rss"])))
+    if r.get("listfile_size") is not None:
+        out.append(("listfile size", _size(r["listfile_size"])))
+    if r.get("events") is not None:
+        out.append(("events", "%d in %d files"
+                    % (r["events"], r.get("files", 0))))
+    if r.get("events_per_second") is not None:
+        out.append(("throughput", "%.1f events/s, %.1f files/s"
+                    % (r["events_per_second"], r["files_per_second"])))
+    if r.get("parse_time") is not None:
+        out.append(("listfile parse time", "%.2f s" % r["parse_time"]))
+    if r.get("report_time") is not None:
+        out.append(("report generation time", "%.2f s" % r["report_time"]))
+    return out
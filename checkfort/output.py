@@ -0,0 +1,214 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import tarfile
+import zipfile
+from cStringIO import StringIO
+
+from checkfort.exceptions import *
+from checkfort.logging import p_verbose, p_warn
+
+OUTPUT_FORMATS = ("dir", "gzip", "zip", "tar.gz")
+
+# formats which support incremental output (see DirectorySink)
+INCREMENTAL_FORMATS = ("dir", "gzip")
+
+# file in the output directory listing the files of the previous report
+MANIFEST = ".cfort_manifest"
+
+
+class OutputSink(object):
+    """
+    Destination of the generated report.
+
+    Files are written one at a time with write() and are never read back,
+    so sinks can stream straight into an archive. close() must be called
+    once all files are written.
+    """
+    def __init__(self, location):
+        self.location = location
+
+    def write(self, relpath, data):
+        """Write data (str or unicode) to relpath within the report"""
+        raise NotImplementedError
+
+    def close(self, complete=True):
+        """complete is False if writing the report was interrupted"""
+        pass
+
+    def index_hint(self):
+        """Returns a message telling users where to find index.html"""
+        return "View '%s' for results." % os.path.join(self.location,
+                                                       "index.html")
+
+    @staticmethod
+    def encode(data):
+        if isinstance(data, unicode):
+            return data.encode('utf-8')
+        return data
+
+
+class DirectorySink(OutputSink):
+    """
+    Writes the report as a directory tree.
+
+    If incremental is True, a manifest of the files written and the hash of
+    their content is kept in the directory (see MANIFEST). On the next run,
+    files whose content did not change are not rewritten, and files of the
+    previous report which are no longer written are removed.
+    """
+    def __init__(self, location, incremental=False):
+        super(DirectorySink, self).__init__(location)
+        self.known_dirs = set()
+        self._makedirs(location)
+        self.incremental = incremental
+        self.manifest = {}  # relpath -> hash of content
+        self.previous = self._load_manifest() if incremental else {}
+        # until close(), the manifest may not match the files written. A
+        # run which is not incremental makes it stale for good.
+        try:
+            os.remove(os.path.join(self.location, MANIFEST))
+        except OSError:
+            pass
+        self.stats = {"written": 0, "unchanged": 0, "removed": 0}
+
+    def _makedirs(self, path):
+        if not path or path in self.known_dirs:
+            return
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.known_dirs.add(path)
+
+    def _target(self, relpath):
+        """Returns path of the file written for relpath"""
+        return os.path.join(self.location, relpath)
+
+    def _open(self, path):
+        return open(path, 'wb')
+
+    def write(self, relpath, data):
+        data = self.encode(data)
+        path = self._target(relpath)
+        if self.incremental:
+            digest = hashlib.sha1(data).hexdigest()
+            self.manifest[relpath] = digest
+            if self.previous.get(relpath) == digest and os.path.isfile(path):
+                self.stats["unchanged"] += 1
+                return
+        self._makedirs(os.path.dirname(path))
+        with self._open(path) as f:
+            f.write(data)
+        self.stats["written"] += 1
+
+    def close(self, complete=True):
+        if not (self.incremental and complete):
+            return
+        for relpath in set(self.previous).difference(self.manifest):
+            path = self._target(relpath)
+            try:
+                os.remove(path)
+                self.stats["removed"] += 1
+                os.removedirs(os.path.dirname(path))  # if now empty
+            except OSError:
+                pass
+        self._save_manifest()
+        p_verbose(" - %(written)d files written, %(unchanged)d unchanged, "
+                  "%(removed)d removed" % self.stats)
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.location, MANIFEST)) as f:
+                return json.load(f)["files"]
+        except (IOError, ValueError, KeyError, TypeError):
+            return {}
+
+    def _save_manifest(self):
+        try:
+            with open(os.path.join(self.location, MANIFEST), "w") as f:
+                json.dump({"files": self.manifest}, f, sort_keys=True,
+                          separators=(',', ':'))
+        except IOError:
+            p_warn("Could not write %s" % os.path.join(self.location,
+                                                       MANIFEST))
+
+
+class GzipSink(DirectorySink):
+    """
+    Writes the report as a directory tree of precompressed files (e.g.
+    index.html.gz) for serving by web servers which support static gzip.
+    """
+    def _target(self, relpath):
+        return os.path.join(self.location, relpath) + ".gz"
+
+    def _open(self, path):
+        # fixed mtime so unchanged content gives identical files
+        return gzip.GzipFile(path, 'wb', mtime=0)
+
+    def index_hint(self):
+        return ("Serve '%s' with static gzip support enabled to view "
+                "the results." % self.location)
+
+
+class ZipSink(OutputSink):
+    """Streams the report into a single zip archive"""
+    def __init__(self, location):
+        super(ZipSink, self).__init__(location)
+        self.archive = zipfile.ZipFile(location, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, relpath, data):
+        info = zipfile.ZipInfo(relpath, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0644 << 16L
+        self.archive.writestr(info, self.encode(data))
+
+    def close(self, complete=True):
+        self.archive.close()
+
+    def index_hint(self):
+        return "Extract '%s' and view index.html for results." % self.location
+
+
+class TarSink(ZipSink):
+    """Streams the report into a single gzip compressed tar archive"""
+    def __init__(self, location):
+        OutputSink.__init__(self, location)
+        self.archive = tarfile.open(location, 'w:gz')
+        self.mtime = time.time()
+
+    def write(self, relpath, data):
+        data = self.encode(data)
+        info = tarfile.TarInfo(relpath)
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0644
+        self.archive.addfile(info, StringIO(data))
+
+
+def get_sink(outdir, output_format="dir", incremental=False):
+    """
+    Returns an OutputSink for the given format. For archive formats, the
+    archive extension is appended to outdir if it is not already there.
+    incremental is only supported by INCREMENTAL_FORMATS.
+    """
+    if incremental and output_format not in INCREMENTAL_FORMATS:
+        raise CheckfortException("Incremental output not supported for "
+                                 "output format - %s" % output_format)
+    if output_format == "dir":
+        return DirectorySink(outdir, incremental)
+    elif output_format == "gzip":
+        return GzipSink(outdir, incremental)
+    elif output_format in ("zip", "tar.gz"):
+        extension = "." + output_format
+        if not outdir.endswith(extension):
+            outdir += extension
+        parent = os.path.dirname(outdir)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        if output_format == "zip":
+            return ZipSink(outdir)
+        return TarSink(outdir)
+    raise CheckfortException("Unsupported output format - %s. "
+                             "Possible options: %s"
+                             % (output_format, ", ".join(OUTPUT_FORMATS)))
@@ -0,0 +1,89 @@
+import mmap
+import multiprocessing
+
+from checkfort.exceptions import *
+from checkfort.parser import ParserState, FileEvent
+from checkfort.fastparser import FastForcheckParser, ListfileIndex
+from checkfort.logging import p_verbose
+
+# file events sections smaller than this are parsed serially, and chunks
+# are never made smaller than this.
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+
+# number of chunks per worker. More chunks than workers evens out the load
+# when pages vary in event density.
+CHUNKS_PER_JOB = 4
+
+_worker = {}  # parse context of worker processes. See _init_worker()
+
+
+def _init_worker(listfile, pages, legacy_mode, event_filter, keep_instances):
+    f = open(listfile, "rb")
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    _worker["index"] = ListfileIndex(buf, pages)
+    _worker["legacy_mode"] = legacy_mode
+    _worker["event_filter"] = event_filter
+    _worker["keep_instances"] = keep_instances
+
+
+def _parse_chunk(bounds):
+    """Parse file events within bounds, returns a partial ParserState"""
+    state = ParserState(_worker["legacy_mode"],
+                        event_filter=_worker["event_filter"],
+                        keep_instances=_worker["keep_instances"])
+    _worker["index"].feed_anchors(FileEvent(state), *bounds)
+    return state
+
+
+class ParallelForcheckParser(FastForcheckParser):
+    """
+    Parser for forcheck listfiles which distributes the file events section
+    across multiple processes.
+
+    The file events section is split at page boundaries into chunks which are
+    parsed independently. The resulting partial states are merged in
+    listfile order so results are identical to those of ForcheckParser.
+    Global events and the forcheck summary are parsed serially.
+    """
+    def __init__(self, forcheck_listfile, jobs=None, **kwargs):
+        self.jobs = jobs or multiprocessing.cpu_count()
+        super(ParallelForcheckParser, self).__init__(forcheck_listfile,
+                                                     **kwargs)
+
+    def _parse_section(self, index, stage, start, end):
+        chunks = self._split(index, start, end)
+        if not isinstance(stage["parser"], FileEvent) or len(chunks) < 2:
+            return super(ParallelForcheckParser, self)._parse_section(
+                                                index, stage, start, end)
+
+        p_verbose("   (using %d processes for %d chunks)"
+                  % (self.jobs, len(chunks)))
+        pool = multiprocessing.Pool(self.jobs, _init_worker,
+                                    (self.listfile, index.get_pages(),
+                                     self.state.legacy_mode,
+                                     self.state.event_filter,
+                                     self.state.keep_instances))
+        try:
+            partial_states = pool.map(_parse_chunk, chunks, chunksize=1)
+        finally:
+            pool.terminate()
+
+        for partial_state in partial_states:
+            self.state.merge(partial_state)
+
+    def _split(self, index, start, end):
+        """Split [start, end) at page boundaries. Returns list of bounds"""
+        count = min(self.jobs * CHUNKS_PER_JOB, (end - start) // MIN_CHUNK_SIZE)
+        if self.jobs < 2 or count < 2:
+            return [(start, end)]
+
+        bounds = [start]
+        for i in xrange(1, count):
+            page = index.page_of(start + (end - start) * i // count) + 1
+            if page < len(index.page_starts):
+                boundary = index.page_starts[page]
+                if bounds[-1] < boundary < end:
+                    bounds.append(boundary)
+        bounds.append(end)
+        return zip(bounds[:-1], bounds[1:])
@@ -3,7 +3,9 @@ import sys
 from collections import defaultdict, namedtuple
 
 from checkfort.exceptions import *
-from checkfort.logging import p_debug, p_verbose, p_info
+from checkfort.filters import EventFilter
+from checkfort.units import UnitGraph
+from checkfort.logging import p_debug, p_verbose, p_info, p_warn
 
 
 class EventInstance(object):
@@ -25,28 +27,113 @@ class EventInstance(object):
                                         self.linenum)
 
 
+def instance_key(instance):
+    """Sort key of event instances: by file and line, global events last"""
+    return (instance.filename is None, instance.filename, instance.linenum)
+
+
+def event_key(code, instance):
+    """Identifies an event reported in several listfiles or forcheck runs"""
+    return (instance.filename, instance.linenum, code, instance.culprit)
+
+
 class ParserState(object):
-    def __init__(self, legacy_mode=False, ignore_list=None):
+    def __init__(self, legacy_mode=False, ignore_list=None, event_filter=None,
+                 keep_instances=True):
         self.legacy_mode = legacy_mode
+        # if False, only event counts and messages are stored
+        self.keep_instances = keep_instances
         self.sums = {}
         self.event_message = defaultdict(str)
         self.event_counter = defaultdict(int)
         self.event_instances = defaultdict(list)
         self.file_events = defaultdict(list)
         #self.global_events = defaultdict(list)
-        self.ignore_list = set(int(x) for x in ignore_list)
+        # file events per file and line number
+        self.line_index = defaultdict(dict)
+        # codes whose instances were not stored in instance_key() order, and
+        # their instances sorted by instance_key() (see sorted_instances())
+        self._unsorted = set()
+        self._sorted = {}
+        self._last_key = {}
+        if event_filter is None:
+            event_filter = EventFilter(codes=ignore_list)
+        self.event_filter = event_filter
+        self.ignore_list = event_filter.codes
+        # number of events dropped by file/culprit filters, indexed by code.
+        # Needed to validate the sums of partially filtered codes.
+        self.filtered_counter = defaultdict(int)
+        # program units analysed by forcheck, and references between them
+        self.units = UnitGraph()
+        # description of why results are incomplete (e.g. truncated listfile)
+        self.partial = None
         self.debug_required = False
 
     def _should_ignore(self, code):
-        if not self.ignore_list:
-            return False
-        numeric, syntax = code.split(None, 1)
-        return (int(numeric) in self.ignore_list)
+        return self.event_filter.drops_code(code)
 
     def _store_event(self, code, message, instance):
-        if self._should_ignore(code):
-            return
         self.event_instances[code].append(instance)
+        self._index_event(code, instance)
+        self._count_event(code, message)
+
+    def _index_event(self, code, instance):
+        key = instance_key(instance)
+        if code in self._last_key and key < self._last_key[code]:
+            self._unsorted.add(code)
+        self._last_key[code] = key
+        if self._sorted:
+            self._sorted.pop(code, None)
+        if instance.filename is not None:
+            self.line_index[instance.filename].setdefault(
+                instance.linenum, []).append(instance)
+
+    def sorted_instances(self, code):
+        """
+        Returns instances of code sorted by file and line number, with global
+        events last. Instances on the same line (and global events) are in
+        the order they were stored in.
+
+        Events are usually stored in this order already, in which case
+        event_instances[code] is returned. Otherwise they are sorted once.
+        """
+        if code not in self._unsorted:
+            return self.event_instances[code]
+        try:
+            return self._sorted[code]
+        except KeyError:
+            instances = sorted(self.event_instances[code], key=instance_key)
+            self._sorted[code] = instances
+            return instances
+
+    def grouped_instances(self, code):
+        """
+        Returns (files, global_instances) for instances of code, where files
+        is a list of (filename, count, lines) sorted by filename, and lines is
+        a list of (linenum, instances) sorted by line number.
+        """
+        files, global_instances = [], []
+        for e in self.sorted_instances(code):
+            if e.filename is None:
+                global_instances.append(e)
+                continue
+            if not files or files[-1][0] != e.filename:
+                files.append([e.filename, 0, []])
+            lines = files[-1][2]
+            files[-1][1] += 1
+            if not lines or lines[-1][0] != e.linenum:
+                lines.append((e.linenum, []))
+            lines[-1][1].append(e)
+        return files, global_instances
+
+    def file_lines(self, filename):
+        """
+        Returns list of (linenum, instances) of the events in filename,
+        sorted by line number
+        """
+        return sorted(self.line_index.get(filename, {}).iteritems())
+
+    def _count_event(self, code, message):
         self.event_counter[code] += 1
 
         if not code in self.event_message:
@@ -57,11 +144,74 @@ class ParserState(object):
                 p_debug("Seeing different messages for "
                                  "event code (%s).\n" % code)
 
+    def merge(self, other):
+        """
+        Add the events stored in other (a ParserState) to this state.
+
+        Instances are appended after those already stored, and messages
+        seen first are kept, so merging partial states in listfile order
+        gives the same result as parsing the whole listfile at once.
+        """
+        for code, count in other.event_counter.iteritems():
+            self.event_counter[code] += count
+        for code, count in other.filtered_counter.iteritems():
+            self.filtered_counter[code] += count
+        for code, instances in other.event_instances.iteritems():
+            self.event_instances[code].extend(instances)
+            for e in instances:
+                self._index_event(code, e)
+        for filename, instances in other.file_events.iteritems():
+            self.file_events[filename].extend(instances)
+        for code, message in other.event_message.iteritems():
+            if not code in self.event_message:
+                self.event_message[code] = message
+            elif message != self.event_message[code]:
+                self.debug_required = True
+                p_debug("Seeing different messages for "
+                        "event code (%s).\n" % code)
+        self.sums.update(other.sums)
+        self.units.merge(other.units)
+        self.partial = self.partial or other.partial
+        self.debug_required = self.debug_required or other.debug_required
+
+    def subset(self, keep):
+        """
+        Returns ParserState with the event instances for which
+        keep(code, instance) is true, in the same order, along with the
+        units, partial flag and filtered counts of this state.
+        """
+        out = ParserState(self.legacy_mode, event_filter=self.event_filter)
+        out.filtered_counter.update(self.filtered_counter)
+        out.units = self.units
+        out.partial = self.partial
+        kept = set()
+        for code, instances in self.event_instances.iteritems():
+            message = self.event_message[code]
+            for e in instances:
+                if keep(code, e):
+                    out._store_event(code, message, e)
+                    kept.add(id(e))
+        for filename, instances in self.file_events.iteritems():
+            kept_instances = [e for e in instances if id(e) in kept]
+            if kept_instances:
+                out.file_events[filename] = kept_instances
+        return out
+
     def store_sums(self, name, total):
         self.sums[name] = total
 
+    def store_unit(self, name, kind, filename):
+        self.units.add_unit(name, kind, filename)
+
     def store_file_event(self, filename, linenum, code, message, culprit):
-        if self._should_ignore(code):
+        if self.event_filter.drops_code(code):
+            return
+        if (self.event_filter.drops_file(filename)
+                or self.event_filter.drops_culprit(culprit)):
+            self.filtered_counter[code] += 1
+            return
+        if not self.keep_instances:
+            self._count_event(code, message)
             return
         instance = EventInstance(code, culprit, linenum, filename)
         self._store_event(code, message, instance)
@@ -69,7 +219,13 @@ class ParserState(object):
             self.file_events[filename].append(instance)
 
     def store_global_event(self, code, message, details):
-        if self._should_ignore(code):
+        if self.event_filter.drops_code(code):
+            return
+        if self.event_filter.drops_culprit(details):
+            self.filtered_counter[code] += 1
+            return
+        if not self.keep_instances:
+            self._count_event(code, message)
             return
         instance = EventInstance(code, details)
         self._store_event(code, message, instance)
@@ -79,18 +235,33 @@ class ParserState(object):
 class ForcheckParser(object):
     # set legacy mode for forcheck version <14.1
     def __init__(self, forcheck_listfile,
-                 legacy_mode=False, ignore_list=None):
+                 legacy_mode=False, ignore_list=None, event_filter=None,
+                 keep_instances=True):
         self.listfile = forcheck_listfile
-        self.state = ParserState(legacy_mode, ignore_list=ignore_list)
+        self.state = ParserState(legacy_mode, ignore_list=ignore_list,
+                                 event_filter=event_filter,
+                                 keep_instances=keep_instances)
+        # set by _scan() if the listfile ends with an incomplete line
+        self.truncated = False
         self._parse()
 
     def _parse(self):
         p_info("\nParsing forcheck listfile")
-        if self.state.ignore_list:
-            p_info("(ignoring the following forcheck events: "
-                   "%s)" % ", ".join(str(x) for x in self.state.ignore_list))
-
-        stages = iter((
+        if self.state.event_filter:
+            p_info("(ignoring forcheck events matching the following - "
+                   "%s)" % "; ".join(self.state.event_filter.describe()))
+
+        stages = self._get_stages()
+        self._scan(stages)
+        self._check_complete(stages)
+        self._check_result()
+
+    def _get_stages(self):
+        """
+        Returns list of listfile sections, in the order they appear. _scan()
+        sets "reached" for each section found in the listfile.
+        """
+        return [
             {"name": "file events",
              "end_marker": "global program analysis:",
              "parser": FileEvent(self.state)},
@@ -100,16 +271,28 @@ class ForcheckParser(object):
             {"name": "program units",
              # "end_marker": "*END OF ANALYSIS*"  # no longer appear in >14.3
              "end_marker": "messages presented:",
-             "parser": None},
+             "parser": ProgramUnitEvent(self.state)},
             {"name": "forcheck summary",
              "end_marker": None,
              "parser": SummaryEvent(self.state)},
-        ))
+        ]
 
+    def _scan(self, stages):
+        """Feed each line of the listfile to the parser of its section"""
+        stages = iter(stages)
         lines = ("", "", "")  # (current, previous, previous-1)
         stage = stages.next()
+        stage["reached"] = True
         p_info(" - Parsing %s" % stage["name"])
 
+        def complete_lines(f):
+            """Iterates lines of f. Stops at an incomplete last line"""
+            for L in f:
+                if not L.endswith("\n"):
+                    self.truncated = True
+                    return
+                yield L
+
         def forward_to_content(file_iterator):
             """
             Forwards file iterator the the actual content, then returns
@@ -131,18 +314,40 @@ class ForcheckParser(object):
             return target_file
 
         with open(self.listfile) as f:
-            target_file = forward_to_content(f)
+            f = complete_lines(f)
+            try:
+                target_file = forward_to_content(f)
+            except StopIteration:
+                raise ParseError("Empty listfile - " + self.listfile)
             for L in f:
                 if L.startswith("\f"):  # new page. forward to content
-                    target_file = forward_to_content(f)
+                    try:
+                        target_file = forward_to_content(f)
+                    except StopIteration:  # truncated within page header
+                        break
                     continue
                 lines = (L.strip(), lines[0], lines[1])  # shift
                 if lines[0] == stage["end_marker"]:
                     stage = stages.next()
+                    stage["reached"] = True
                     p_info(" - Parsing %s" % stage["name"])
                 elif stage["parser"]:  # if event has a parser
                     stage["parser"].slurp(target_file, *lines)
 
+    def _check_complete(self, stages):
+        """Mark state as partial if the listfile is truncated"""
+        problems = []
+        if self.truncated:
+            problems.append("ends with an incomplete line")
+        missing = [s["name"] for s in stages if not s.get("reached")]
+        if missing:
+            problems.append("missing sections: %s" % ", ".join(missing))
+        if problems:
+            self.state.partial = ("Forcheck listfile is incomplete (%s)"
+                                  % "; ".join(problems))
+            p_warn("%s. Results are partial." % self.state.partial)
+
+    def _check_result(self):
         if self.state.debug_required:
             import shutil
             listfile_out = "forcheck_listfile.debug"
@@ -160,6 +365,10 @@ class ForcheckParser(object):
 class Event(object):
     """Base class for Event parsers"""
 
+    # True if slurp() only acts on lines starting with "**[". Such parsers
+    # can be fed just the event lines (and the two lines preceding them).
+    anchored = False
+
     # precompile frequently used regex patterns
     re_err = re.compile(r"^\*\*\[\s*(\d+ [IEWO])\] (.*)")
     re_file = re.compile(r"^\(file: ([^,]+), line:\s+(\d+)\)")
@@ -171,6 +380,8 @@ class Event(object):
 
 
 class FileEvent(Event):
+    anchored = True
+
     def slurp(self, target_file, line, line1, line2):
         # file events always start with "**["
         if not line.startswith("**["):
@@ -211,6 +422,8 @@ class FileEvent(Event):
 
 
 class GlobalEvent(Event):
+    anchored = True
+
     def slurp(self, target_file, line, line1, line2):
         assert target_file is None
 
@@ -235,6 +448,38 @@ class GlobalEvent(Event):
         self.state.store_global_event(code, message, details)
 
 
+class ProgramUnitEvent(Event):
+    """
+    Parses the list of program units and procedures analysed, i.e. entries
+    such as "12. SOLVE   subroutine (src/solve.f90)"
+    """
+    re_unit = re.compile(r"^(\d+)\.\s+([A-Za-z_$][\w$]*)\s*(.*)")
+    re_unit_file = re.compile(r"\(([^()\s]*[./][^()\s]*)\)|file:\s*(\S+)")
+    unit_kinds = ("block data", "main program", "program",
+                  "module procedure", "module", "subroutine", "function",
+                  "entry", "interface")
+
+    def slurp(self, target_file, line, line1, line2):
+        assert target_file is None
+        match = ProgramUnitEvent.re_unit.match(line)
+        if not match:
+            return
+        number, name, details = match.groups()
+
+        lowered = details.lower()
+        for kind in ProgramUnitEvent.unit_kinds:
+            if kind in lowered:
+                break
+        else:
+            kind = None
+
+        filename = None
+        match = ProgramUnitEvent.re_unit_file.search(details)
+        if match:
+            filename = match.group(1) or match.group(2)
+        self.state.store_unit(name, kind, filename)
+
+
 class SummaryEvent(Event):
     def slurp(self, target_file, line, line1, line2):
         assert target_file is None
@@ -247,9 +492,10 @@ class SummaryEvent(Event):
     def validate_sums(self, count, code, message):
         if self.state._should_ignore(code):
             return
-        if self.state.event_counter[code] != int(count):
+        found = (self.state.event_counter.get(code, 0)
+                 + self.state.filtered_counter.get(code, 0))
+        if found != int(count):
             self.state.debug_required = True
             p_debug("Parsed results does not match "
                     "forcheck summary (%s)." % code)
-            p_debug("  Found %d, summary states %s" %
-                   (self.state.event_counter[code], count))
+            p_debug("  Found %d, summary states %s" % (found, count))
@@ -0,0 +1,327 @@
+import os
+import re
+import json
+from time import time
+from collections import defaultdict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from checkfort.exceptions import *
+from checkfort.forcheck import Forcheck, EXIT_CODES, RC_OVERFLOW
+from checkfort.forcheck import RC_COMPLETE
+from checkfort.parser import ParserState, event_key
+from checkfort.units import re_use
+from checkfort.monitor import combine_resources
+from checkfort.logging import p_info, p_verbose, p_warn
+
+# suffix of the file used to remember the partition size which avoided a
+# table overflow. Appended to the output directory by the launcher, e.g.
+# cfort_html.cfort_partition, and to the project name in batch mode.
+PARTITION_CACHE = ".cfort_partition"
+
+
+class ModuleDependencies(object):
+    """
+    Maps each file to the files defining the modules it USEs (deps), and
+    to the files it INCLUDEs (includes).
+
+    Uses a simple scan of MODULE/USE/INCLUDE statements. Modules which are
+    not defined in any of the files (e.g. intrinsic modules) are ignored.
+    Included files are looked up next to the including file, then among the
+    input files by name. They need not be input files themselves.
+    """
+    re_module = re.compile(r"^[ \t]*module[ \t]+(\w+)[ \t]*(?:!.*)?$",
+                           re.I | re.M)
+    re_use = re_use
+    re_include = re.compile(r"^[ \t]*#?[ \t]*include[ \t]*['\"<]([^'\">]+)",
+                            re.I | re.M)
+
+    def __init__(self, files):
+        self.files = files
+        uses = {}
+        providers = {}
+        basenames = {}
+        for filename in files:
+            basenames.setdefault(os.path.basename(filename), filename)
+        self.includes = {}
+        for filename in files:
+            try:
+                with open(filename) as f:
+                    content = f.read()
+            except IOError:
+                content = ""
+            for module in self.re_module.findall(content):
+                providers.setdefault(module.lower(), filename)
+            uses[filename] = set(x.lower() for x in
+                                 self.re_use.findall(content))
+            self.includes[filename] = set(
+                self._resolve_include(filename, x, basenames)
+                for x in self.re_include.findall(content))
+
+        self.deps = dict((filename, set(providers[m] for m in modules
+                                        if m in providers) - set([filename]))
+                         for filename, modules in uses.iteritems())
+        self._closures = {}
+
+    @staticmethod
+    def _resolve_include(filename, name, basenames):
+        path = os.path.normpath(os.path.join(os.path.dirname(filename), name))
+        if os.path.exists(path):
+            return path
+        return basenames.get(os.path.basename(name), os.path.normpath(name))
+
+    def dependents(self, files):
+        """
+        Returns set of files and all input files which (indirectly) USE a
+        module defined in, or INCLUDE, any of them
+        """
+        users = defaultdict(set)
+        for mapping in (self.deps, self.includes):
+            for filename, used in mapping.iteritems():
+                for x in used:
+                    users[x].add(filename)
+        found = set(files)
+        pending = list(found)
+        while pending:
+            for user in users.get(pending.pop(), ()):
+                if user not in found:
+                    found.add(user)
+                    pending.append(user)
+        return found
+
+    def closure(self, filename):
+        """Returns set of filename and all files it (indirectly) depends on"""
+        try:
+            return self._closures[filename]
+        except KeyError:
+            pass
+        found = set([filename])
+        pending = [filename]
+        while pending:
+            for dep in self.deps.get(pending.pop(), ()):
+                if dep not in found:
+                    found.add(dep)
+                    pending.append(dep)
+        self._closures[filename] = found
+        return found
+
+    def components(self, files):
+        """Returns groups of files (in input order) linked by dependencies"""
+        parent = dict((f, f) for f in files)
+
+        def find(f):
+            while parent[f] != f:
+                parent[f] = parent[parent[f]]
+                f = parent[f]
+            return f
+
+        for filename in files:
+            for dep in self.deps.get(filename, ()):
+                if dep in parent:
+                    parent[find(dep)] = find(filename)
+
+        groups = defaultdict(list)
+        order = []
+        for filename in files:
+            root = find(filename)
+            if root not in groups:
+                order.append(root)
+            groups[root].append(filename)
+        return [groups[root] for root in order]
+
+    def partition(self, files, max_size):
+        """
+        Split files into parts of (about) max_size files without breaking
+        up groups of dependent files where possible.
+
+        Returns list of (owned, required) where owned are the files whose
+        events belong to the part and required are the files to pass to
+        forcheck, i.e. owned plus the files they depend on.
+        """
+        parts = []
+        owned, required = [], set()
+
+        def flush():
+            if owned:
+                parts.append((owned[:], required.copy()))
+            del owned[:]
+            required.clear()
+
+        for group in self.components(files):
+            if len(group) <= max_size:
+                if len(required.union(group)) > max_size:
+                    flush()
+                owned.extend(group)
+                required.update(group)
+                continue
+
+            # group too large. Split it, pulling in dependencies as required
+            flush()
+            for filename in group:
+                closure = self.closure(filename)
+                if owned and len(required.union(closure)) > max_size:
+                    flush()
+                owned.append(filename)
+                required.update(closure)
+            flush()
+        flush()
+
+        return [(o, [x for x in self.files if x in r]) for o, r in parts]
+
+
+class OverflowSplitter(object):
+    """
+    Runs forcheck, and on table overflow re-runs it on smaller parts of the
+    input (split along module dependencies) and merges the parsed results.
+
+    Parts which still overflow are split further. The part size which worked
+    is remembered in PARTITION_CACHE so later runs can start with it.
+
+    parse is a callable which takes the path of a forcheck listfile and
+    returns a ParserState.
+    """
+    def __init__(self, files, parse, jobs=None, cache_file=PARTITION_CACHE,
+                 logfile="forcheck.log", **forcheck_args):
+        self.files = files
+        self.parse = parse
+        self.jobs = jobs or cpu_count()
+        self.cache_file = cache_file
+        self.logfile = logfile
+        self.forcheck_args = forcheck_args
+        self.working_size = None
+        self.dependencies = None
+
+    def run(self):
+        """Returns (ParserState, run_data)"""
+        size = self._load_partition_size()
+        if size is None or size >= len(self.files):
+            f = Forcheck(self.files, **self.forcheck_args)
+            f.run(out=self.logfile)
+            if f.rc != RC_OVERFLOW or len(self.files) < 2:
+                return self.parse(f.get_tmp_filename()), f.get_run_data()
+            size = (len(self.files) + 1) // 2
+            p_info("\nTable overflow. Splitting input into parts of "
+                   "%d files" % size)
+        else:
+            p_info("\nSplitting input into parts of %d files (from %s)"
+                   % (size, self.cache_file))
+
+        self.dependencies = ModuleDependencies(self.files)
+        start = time()
+        runs = self._run_parts(self.files, size)
+        elapsed = time() - start
+        if self.working_size:
+            self._save_partition_size(self.working_size)
+        return self._merge(runs, elapsed)
+
+    def _run_parts(self, files, size):
+        """Returns list of (owned, required, Forcheck instance)"""
+        parts = self.dependencies.partition(files, size)
+        p_verbose(" - running %d parts of up to %d files"
+                  % (len(parts), size))
+
+        log_root, log_ext = os.path.splitext(self.logfile)
+
+        def run_part(args):
+            i, (owned, required) = args
+            f = Forcheck(required, **self.forcheck_args)
+            f.run(out="%s.part%d-%d%s" % (log_root, size, i, log_ext))
+            return f
+
+        pool = ThreadPool(min(self.jobs, len(parts)))
+        try:
+            results = pool.map(run_part, enumerate(parts), chunksize=1)
+        finally:
+            pool.close()
+
+        runs = []
+        for (owned, required), f in zip(parts, results):
+            if f.rc == RC_OVERFLOW and len(owned) > 1:
+                runs.extend(self._run_parts(owned, (len(owned) + 1) // 2))
+            else:
+                if f.rc == RC_OVERFLOW:
+                    p_warn("Table overflow persists for %s" % owned[0])
+                elif f.rc in RC_COMPLETE and (self.working_size is None
+                                              or size < self.working_size):
+                    # only sizes of runs which completed are remembered
+                    self.working_size = size
+                runs.append((owned, required, f))
+        return runs
+
+    def _merge(self, runs, elapsed):
+        p_info("\nMerging results of %d forcheck runs" % len(runs))
+        state = None
+        seen = set()
+        sums = defaultdict(int)
+        for owned, required, f in runs:
+            partial = self.parse(f.get_tmp_filename())
+            if state is None:
+                state = ParserState(partial.legacy_mode,
+                                    event_filter=partial.event_filter)
+            state.merge(self._owned_events(partial, set(owned), required,
+                                           seen))
+            for name, total in partial.sums.iteritems():
+                sums[name] += int(total)
+
+        state.sums = dict((k, str(v)) for k, v in sums.iteritems())
+        rc = max(f.rc for owned, required, f in runs)
+        run_data = runs[0][2].get_run_data()
+        run_data.update({
+            "rc": rc,
+            "rc_message": EXIT_CODES[rc],
+            "command": "\n".join(" ".join(f.get_command())
+                                 for owned, required, f in runs),
+            "partitions": len(runs),
+            "resources": combine_resources(f.resources
+                                           for owned, required, f in runs),
+            "aborted": "; ".join(f.aborted for owned, required, f in runs
+                                 if f.aborted) or None,
+        })
+        if run_data["resources"]:
+            # parts run concurrently and share required files
+            run_data["resources"]["wall_time"] = elapsed
+            run_data["resources"]["files"] = len(self.files)
+        return state, run_data
+
+    def _owned_events(self, partial, owned, required, seen):
+        """
+        Returns ParserState with the events of partial which belong to this
+        part, i.e. dropping events reported against files owned by other
+        parts. Events against files which are not inputs (e.g. include
+        files) and global events are dropped if seen in previous parts.
+        """
+        foreign = set(required).difference(owned)
+        new = set()
+
+        def keep(code, e):
+            if e.filename in foreign:
+                return False
+            elif e.filename not in owned:
+                key = event_key(code, e)
+                if key in seen:
+                    return False
+                new.add(key)
+            return True
+
+        out = partial.subset(keep)
+        seen.update(new)
+        return out
+
+    def _load_partition_size(self):
+        try:
+            with open(self.cache_file) as f:
+                return int(json.load(f)["partition_size"])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_partition_size(self, size):
+        p_verbose(" - remembering partition size (%d) in %s"
+                  % (size, self.cache_file))
+        dirname = os.path.dirname(self.cache_file)
+        try:
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(self.cache_file, "w") as f:
+                json.dump({"partition_size": size}, f)
+        except (IOError, OSError):
+            p_warn("Could not write %s" % self.cache_file)
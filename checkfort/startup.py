@@ -0,0 +1,60 @@
+from time import time
+from multiprocessing.pool import ThreadPool
+
+from checkfort.logging import p_verbose
+
+
+def _timed(times, name, func, args):
+    start = time()
+    try:
+        return func(*args)
+    finally:
+        times[name] = time() - start
+
+
+class Startup(object):
+    """
+    Runs independent startup tasks (e.g. probing forchk, loading templates)
+    in a pool of threads while the main thread gets on with other phases
+    (e.g. searching for input files, see timed()).
+
+    Background tasks must not print anything or report errors. Their
+    results should be cached (e.g. forcheck.probe_forcheck()), so that the
+    main thread reports them, and raises any errors, at the same point and
+    in the same order as if the tasks had not been run ahead of time.
+    """
+    def __init__(self, jobs=2):
+        self.start = time()
+        self.pool = ThreadPool(jobs)
+        self.pending = {}  # name -> AsyncResult
+        self.times = {}  # name -> seconds
+        self.names = []  # in order of submission
+        self.background = set()
+
+    def submit(self, name, func, *args):
+        """Start running func(*args) in the background"""
+        self.names.append(name)
+        self.background.add(name)
+        self.pending[name] = self.pool.apply_async(
+                                _timed, (self.times, name, func, args))
+
+    def timed(self, name, func, *args):
+        """Run func(*args) now, recording the time taken"""
+        self.names.append(name)
+        return _timed(self.times, name, func, args)
+
+    def finish(self):
+        """
+        Wait for all background tasks, ignoring their errors (which are
+        left to whoever uses their results), and print (in verbose mode)
+        the time taken by each phase.
+        """
+        for result in self.pending.itervalues():
+            result.wait()
+        self.pool.close()
+        p_verbose("\nStartup phases:")
+        for name in self.names:
+            p_verbose(" - %s: %.2fs%s" % (name, self.times.get(name, 0),
+                                          " (background)"
+                                          if name in self.background else ""))
+        p_verbose(" - total: %.2fs" % (time() - self.start))
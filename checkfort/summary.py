@@ -0,0 +1,119 @@
+from operator import itemgetter
+
+from checkfort.exceptions import *
+from checkfort.filters import EVENT_CATEGORIES
+
+# exit status when event counts exceed the given thresholds
+RC_THRESHOLD_EXCEEDED = 1
+
+# exit status when results are partial (forchk stopped, truncated listfile)
+RC_PARTIAL = 2
+
+
+class Thresholds(object):
+    """
+    Maximum allowed number of events, per category, per numeric event code
+    and/or in total.
+
+    Created from a spec such as "E=0,W=10,557=5,total=100". Each entry
+    allows at most the given number of events.
+    """
+    def __init__(self, spec):
+        self.categories = {}
+        self.codes = {}
+        self.total = None
+
+        for entry in (x.strip() for x in spec.split(",")):
+            if not entry:
+                continue
+            try:
+                key, limit = (x.strip() for x in entry.split("="))
+                limit = int(limit)
+                if limit < 0:
+                    raise ValueError
+            except ValueError:
+                raise CheckfortException("Invalid threshold - '%s'. "
+                                         "Expecting KEY=COUNT" % entry)
+            if key.lower() == "total":
+                self.total = limit
+            elif key.upper() in EVENT_CATEGORIES:
+                self.categories[key.upper()] = limit
+            elif key.isdigit():
+                self.codes[int(key)] = limit
+            else:
+                raise CheckfortException("Invalid threshold key - '%s'. "
+                                         "Expecting one of %s, an event "
+                                         "code or 'total'"
+                                         % (key, ", ".join(EVENT_CATEGORIES)))
+
+    def __nonzero__(self):
+        return bool(self.categories or self.codes or self.total is not None)
+
+    def check(self, state):
+        """Returns list of messages describing exceeded thresholds"""
+        categories = category_counts(state)
+        codes = {}
+        for code, count in state.event_counter.iteritems():
+            numeric = int(code.split(None, 1)[0])
+            codes[numeric] = codes.get(numeric, 0) + count
+
+        exceeded = []
+        for category, limit in sorted(self.categories.iteritems()):
+            if categories[category] > limit:
+                exceeded.append("%s: %d > %d"
+                                % (category, categories[category], limit))
+        for code, limit in sorted(self.codes.iteritems()):
+            if codes.get(code, 0) > limit:
+                exceeded.append("%d: %d > %d" % (code, codes[code], limit))
+        total = sum(categories.itervalues())
+        if self.total is not None and total > self.total:
+            exceeded.append("total: %d > %d" % (total, self.total))
+        return exceeded
+
+
+def category_counts(state):
+    """Returns number of events per category (I, E, W, O)"""
+    counts = dict((c, 0) for c in EVENT_CATEGORIES)
+    for code, count in state.event_counter.iteritems():
+        counts[code.split(None, 1)[1]] += count
+    return counts
+
+
+def partial_reasons(state):
+    """Returns list of reasons why the results in state are incomplete"""
+    reasons = []
+    aborted = getattr(state, "run_data", {}).get("aborted")
+    if aborted:
+        reasons.append("Forcheck stopped (%s)" % aborted)
+    if state.partial:
+        reasons.append(state.partial)
+    return reasons
+
+
+def format_summary(state):
+    """Returns compact text summary of the events in state"""
+    out = []
+    run_data = getattr(state, "run_data", {})
+    for reason in partial_reasons(state):
+        out.append("PARTIAL RESULTS: %s" % reason)
+    if "rc" in run_data:
+        out.append("Forcheck summary (rc=%s, %s)"
+                   % (run_data["rc"], run_data["rc_message"]))
+    else:
+        out.append("Forcheck summary")
+
+    out.append("  %7s  %-6s %s" % ("count", "code", "message"))
+    for code, count in sorted(state.event_counter.iteritems(),
+                              key=itemgetter(1), reverse=True):
+        out.append("  %7d  %-6s %s" % (count, code,
+                                       state.event_message[code]))
+
+    categories = category_counts(state)
+    out.append("By category: %s (total %d)"
+               % (" ".join("%s=%d" % (c, categories[c])
+                           for c in EVENT_CATEGORIES),
+                  sum(categories.itervalues())))
+    if state.sums:
+        out.append("Forcheck totals: %s"
+                   % ", ".join("%s=%s" % x for x in sorted(state.sums.items())))
+    return "\n".join(out)
@@ -0,0 +1,106 @@
+/*
+ * Client-side search over the prebuilt index in search/.
+ *
+ * The index is sharded by the first two characters of each term. Shards are
+ * loaded on demand as <script> tags (so the report also works when viewed
+ * from file://) and each one calls checkfort_search.register().
+ */
+var checkfort_search = (function () {
+    var MAX_RESULTS = 500;
+    var shards = {}, pending = {}, box = null, results = null;
+
+    function shard_key(term) {
+        var key = [];
+        for (var i = 0; i < term.length && i < 2; i++) {
+            key.push(term.charCodeAt(i).toString(16));
+        }
+        return key.join("_");
+    }
+
+    function escape_html(s) {
+        return String(s).replace(/&/g, "&amp;").replace(/</g, "&lt;")
+                        .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+    }
+
+    function register(key, data) {
+        var callbacks = pending[key] || [];
+        shards[key] = data;
+        delete pending[key];
+        for (var i = 0; i < callbacks.length; i++) {
+            callbacks[i](data);
+        }
+    }
+
+    function load(key, callback) {
+        if (shards.hasOwnProperty(key)) {
+            callback(shards[key]);
+        } else if (pending.hasOwnProperty(key)) {
+            pending[key].push(callback);
+        } else {
+            pending[key] = [callback];
+            var script = document.createElement("script");
+            script.src = "search/" + key + ".js";
+            script.onerror = function () {  /* no terms with this prefix */
+                register(key, {"e": [], "t": {}});
+            };
+            document.getElementsByTagName("head")[0].appendChild(script);
+        }
+    }
+
+    function current_query() {
+        return box.value.replace(/^\s+|\s+$/g, "").toLowerCase();
+    }
+
+    function show(query, data) {
+        var seen = {}, hits = [], html = [], term, ids, i, e;
+        if (query !== current_query()) {
+            return;  /* stale result. query changed while loading shard */
+        }
+        for (term in data.t) {
+            if (data.t.hasOwnProperty(term) && (term === query ||
+                    (query.length > 1 && term.indexOf(query) === 0))) {
+                ids = data.t[term];
+                for (i = 0; i < ids.length; i++) {
+                    if (!seen.hasOwnProperty(ids[i])) {
+                        seen[ids[i]] = true;
+                        hits.push(data.e[ids[i]]);
+                    }
+                }
+            }
+        }
+
+        html.push("<li class='search-count'>" + hits.length +
+                  " event(s) found</li>");
+        for (i = 0; i < hits.length && i < MAX_RESULTS; i++) {
+            e = hits[i];  /* [link, code, filename, linenum, culprit] */
+            html.push("<li><a href='" + escape_html(e[0]) + "'>[" +
+                      escape_html(e[1]) + "]</a> " +
+                      (e[2] ? escape_html(e[2]) +
+                              (e[3] > 0 ? ", line " + e[3] : "") : "") +
+                      (e[4] ? " (" + escape_html(e[4]) + ")" : "") + "</li>");
+        }
+        if (hits.length > MAX_RESULTS) {
+            html.push("<li>(only the first " + MAX_RESULTS +
+                      " results are shown)</li>");
+        }
+        results.innerHTML = html.join("\n");
+    }
+
+    function search() {
+        var query = current_query();
+        if (!query) {
+            results.innerHTML = "";
+            return;
+        }
+        load(shard_key(query), function (data) { show(query, data); });
+    }
+
+    function init(box_id, results_id) {
+        box = document.getElementById(box_id);
+        results = document.getElementById(results_id);
+        box.onkeyup = search;
+        box.onchange = search;
+    }
+
+    return {"register": register, "init": init};
+})();
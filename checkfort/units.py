@@ -0,0 +1,154 @@
+import re
+from collections import defaultdict, deque
+
+from checkfort.exceptions import *
+
+# USE statements (module name in group 1). Shared with
+# splitting.ModuleDependencies so both parse USE statements alike.
+re_use = re.compile(r"^[ \t]*use\b[ \t]*(?:,[ \t]*\w+[ \t]*::)?[ \t]*"
+                    r"(?:::)?[ \t]*(\w+)", re.I | re.M)
+
+
+class UnitGraph(object):
+    """
+    Program units (main programs, modules, subroutines, functions, ...) and
+    the references between them.
+
+    Units are identified by name (case insensitive) and stored by integer
+    id. References are kept in both directions so that dependents() is a
+    breadth-first search over the reverse edges, i.e. linear in the size of
+    the answer rather than the size of the graph.
+    """
+    def __init__(self):
+        self.ids = {}  # lowercased name -> id
+        self.names = []  # id -> name
+        self.kinds = []  # id -> kind (e.g. "module") or None
+        self.files = []  # id -> source file or None
+        self.refs = []  # id -> set of ids of units it references
+        self.rrefs = []  # id -> set of ids of units referencing it
+        self.file_units = defaultdict(list)  # source file -> ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name.lower() in self.ids
+
+    def add_unit(self, name, kind=None, filename=None):
+        """Add unit (or fill in missing details of a known one)"""
+        key = name.lower()
+        uid = self.ids.get(key)
+        if uid is None:
+            uid = self.ids[key] = len(self.names)
+            self.names.append(name)
+            self.kinds.append(kind)
+            self.files.append(None)
+            self.refs.append(set())
+            self.rrefs.append(set())
+        elif kind and not self.kinds[uid]:
+            self.kinds[uid] = kind
+        if filename and not self.files[uid]:
+            self.files[uid] = filename
+            self.file_units[filename].append(uid)
+        return uid
+
+    def add_reference(self, name, target):
+        """Record that unit name references (uses, calls) unit target"""
+        uid, tid = self.ids[name.lower()], self.ids[target.lower()]
+        if uid != tid:
+            self.refs[uid].add(tid)
+            self.rrefs[tid].add(uid)
+
+    def has_references(self):
+        return any(self.refs)
+
+    def unit_id(self, name):
+        try:
+            return self.ids[name.lower()]
+        except KeyError:
+            raise CheckfortException("Unknown program unit - %s" % name)
+
+    def dependencies(self, name, transitive=False):
+        """Returns names of the units name references"""
+        return self._names(self._walk(self.unit_id(name), self.refs,
+                                      transitive))
+
+    def dependents(self, name, transitive=True):
+        """Returns names of the units which (indirectly) reference name"""
+        return self._names(self._walk(self.unit_id(name), self.rrefs,
+                                      transitive))
+
+    def affected_files(self, filenames):
+        """
+        Returns sorted list of filenames, plus the source files of all
+        units depending on units defined in filenames.
+        """
+        start = [uid for f in filenames for uid in self.file_units.get(f, ())]
+        affected = set(filenames)
+        for uid in self._walk_all(start, self.rrefs):
+            if self.files[uid]:
+                affected.add(self.files[uid])
+        return sorted(affected)
+
+    def merge(self, other):
+        for uid, name in enumerate(other.names):
+            self.add_unit(name, other.kinds[uid], other.files[uid])
+        for uid, targets in enumerate(other.refs):
+            for tid in targets:
+                self.add_reference(other.names[uid], other.names[tid])
+
+    def _names(self, ids):
+        return sorted((self.names[x] for x in ids), key=str.lower)
+
+    def _walk(self, uid, edges, transitive):
+        if not transitive:
+            return set(edges[uid])
+        found = self._walk_all([uid], edges)
+        found.discard(uid)
+        return found
+
+    def _walk_all(self, start, edges):
+        found = set(start)
+        pending = deque(start)
+        while pending:
+            for x in edges[pending.popleft()]:
+                if x not in found:
+                    found.add(x)
+                    pending.append(x)
+        return found
+
+    # Regular expressions used by add_source_references()
+    re_start = re.compile(r"^[ \t]*(?![ \t]*end)(?:[\w(),=*:. \t]*?[ \t])?"
+                          r"(program|module|subroutine|function"
+                          r"|block[ \t]*data)[ \t]+(\w+)", re.I)
+    re_use = re_use
+    re_call = re.compile(r"\bcall[ \t]+(\w+)", re.I)
+
+    def add_source_references(self):
+        """
+        Add references found by scanning the source files of known units
+        for USE and CALL statements. References are attributed to the last
+        known unit started before the statement.
+
+        (Function references cannot be told apart from array references
+        without a full parse, and are not detected.)
+        """
+        for filename in self.file_units.keys():
+            try:
+                with open(filename) as f:
+                    lines = f.readlines()
+            except IOError:
+                continue
+            current = None
+            for line in lines:
+                match = self.re_start.match(line)
+                if match:
+                    if match.group(2).lower() in self.ids:
+                        current = match.group(2)
+                    continue
+                if current is None:
+                    continue
+                for target in (self.re_use.findall(line)
+                               + self.re_call.findall(line)):
+                    if target.lower() in self.ids:
+                        self.add_reference(current, target)
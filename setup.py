@@ -38,5 +38,6 @@ setup(
         "Topic :: Utilities",
         ],
     install_requires=["pygments >= 1.4", "jinja2", "chardet", "pexpect"],
-    entry_points={"console_scripts": ["cfort = checkfort.launcher:main"]}
+    entry_points={"console_scripts": ["cfort = checkfort.launcher:main",
+                                      "cfort-batch = checkfort.batch:main"]}
 )